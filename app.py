@@ -78,7 +78,7 @@ def main():
             
             # Show quick summary of logs
             from src.log_manager import LogManager
-            lm = LogManager()
+            lm = LogManager(strava.get_athlete_id())
             logs = lm.list_logs()
             
             st.subheader("Your Analysis History")
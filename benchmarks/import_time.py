@@ -0,0 +1,97 @@
+"""Cold-start import budget check for the app, its pages and the CLI.
+
+Usage:
+    python -m benchmarks.import_time [--repeat 3] [--scale 1.0]
+
+The app and every page under pages/ are found on disk, and the import statements
+at the top level of each script (as written in the file, so a new import is
+measured without listing it here) are timed in a fresh interpreter with Streamlit
+already loaded, as it is on the server. The CLI module is imported whole. The
+heavy modules each entry must not pull in at startup are checked too. Exits
+non-zero when a budget is exceeded or a forbidden module is imported, so CI can
+run it as a gate.
+"""
+import argparse
+import ast
+import glob
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ['sklearn', 'geopy', 'folium', 'plotly', 'pandas', 'stravalib']
+CLI_FORBIDDEN = ['streamlit', 'folium', 'plotly', 'sklearn', 'pandas']
+
+# Budget in seconds for the app and each page script; pages not listed get DEFAULT_BUDGET
+BUDGETS = {'pages/3_logs.py': 0.2, 'pages/5_diagnostics.py': 0.2}
+DEFAULT_BUDGET = 0.5
+CLI_BUDGET = 0.5
+
+_PROBE = """
+import json, sys, time
+{preload}
+before = set(sys.modules)
+start = time.perf_counter()
+{imports}
+elapsed = time.perf_counter() - start
+new = sorted(m for m in set(sys.modules) - before)
+print(json.dumps({{'seconds': elapsed, 'modules': new}}))
+"""
+
+
+def script_imports(path):
+    """Source of the import statements a script runs at startup: those at its top level or in a top-level try."""
+    with open(os.path.join(ROOT, path)) as f:
+        source = f.read()
+    statements = []
+    for node in ast.parse(source).body:
+        body = node.body if isinstance(node, ast.Try) else [node]
+        statements += [ast.get_source_segment(source, n) for n in body if isinstance(n, (ast.Import, ast.ImportFrom))]
+    return "\n".join(statements)
+
+
+def entry_points():
+    """(name, import source, preload streamlit, budget seconds, forbidden modules) for every entry point."""
+    entries = []
+    for path in ['app.py'] + sorted(os.path.relpath(p, ROOT) for p in glob.glob(os.path.join(ROOT, 'pages', '*.py'))):
+        entries.append((path[:-3], script_imports(path), True, BUDGETS.get(path, DEFAULT_BUDGET), HEAVY_MODULES))
+    entries.append(('cli', "import src.cli", False, CLI_BUDGET, CLI_FORBIDDEN))
+    return entries
+
+
+def measure(imports, preload_streamlit):
+    code = _PROBE.format(preload="import streamlit" if preload_streamlit else "", imports=imports)
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=ROOT)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per entry point; the fastest counts")
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiply budgets (slow CI machines)")
+    args = parser.parse_args(argv)
+
+    failures = []
+    print(f"{'entry point':<22}{'import time':>12}{'budget':>10}  heavy modules")
+    for name, imports, preload, budget, forbidden in entry_points():
+        runs = [measure(imports, preload) for _ in range(args.repeat)]
+        seconds = min(r['seconds'] for r in runs)
+        loaded = {m.split('.')[0] for m in runs[0]['modules']}
+        heavy = sorted(m for m in forbidden if m in loaded)
+        limit = budget * args.scale
+
+        print(f"{name:<22}{seconds:>11.3f}s{limit:>9.2f}s  {', '.join(heavy) or '-'}")
+        if seconds > limit:
+            failures.append(f"{name}: {seconds:.3f}s exceeds the {limit:.2f}s budget")
+        if heavy:
+            failures.append(f"{name}: imports {', '.join(heavy)} at startup")
+
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""Load test of the fetch and edit paths against the local mock Strava API.
+
+Usage:
+    python -m benchmarks.load_test [--activities 2000] [--workers 1 2 4 8] [--latency-ms 50 --jitter-ms 50]
+        [--rate-limit 100/5] [--throttle-rate 0.02] [--expired-token] [--edits 200] [--json results.json]
+
+For each worker count a fresh mock server, activity store and token file are set up,
+then StravaClient.fetch_rides_range syncs every month of the fixtures, a second client
+on an empty store reads them again page by page with stream_rides_range, and an
+EditScheduler marks --edits activities as commutes. Reported per phase: wall time,
+throughput, client-observed request latency (p50/p95/p99/max), and the mock's count
+of 429s, 401s and token refreshes. With --expired-token the run starts with an expired
+access token, so StravaAuth has to refresh it first.
+
+Both read phases are checked against the fixtures: each must return exactly the rides
+served by the mock, in at most one request per page per month (plus token refreshes
+and retried 429s). The run fails (exit status 1) when a check does not hold, a read
+phase raises, or an edit still fails after its retries.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.mock_strava import MAX_PER_PAGE, MockStrava, MockStravaServer, load_fixtures, synthetic_activities
+from src.activity_store import ActivityStore
+from src.auth import FileTokenStore
+from src.edit_scheduler import EditJournal, EditScheduler, RateLimiter
+from src.strava_client import StravaClient, month_chunks
+
+DEFAULT_WORKERS = [1, 2, 4, 8]
+PHASES = ('fetch', 'stream', 'edit')
+LIST_ENDPOINT = "GET /api/v3/athlete/activities"
+
+
+def _latencies(client):
+    """List that collects the elapsed time of every response on the client's session."""
+    seconds = []
+    client.protocol.rsession.hooks['response'].append(lambda r, *args, **kwargs: seconds.append(r.elapsed.total_seconds()))
+    return seconds
+
+
+def _list_requests(activities, after, before):
+    """Most list requests a sync of [after, before) should make: every page of each month, plus the short last one."""
+    starts = [datetime.datetime.strptime(a['start_date'], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=datetime.timezone.utc)
+              for a in activities]
+    return sum(sum(start <= s < end for s in starts) // MAX_PER_PAGE + 1 for start, end in month_chunks(after, before))
+
+
+def _check_rides(phase, rides, expected_ids, expected_requests):
+    """Problems with a read phase: rides missing or extra, or more list requests than pages."""
+    problems = []
+    ids = [r.id for r in rides]
+    if len(ids) != len(set(ids)):
+        problems.append(f"{len(ids) - len(set(ids))} duplicate rides")
+    if set(ids) != expected_ids:
+        problems.append(f"{len(set(ids))} rides returned, {len(expected_ids)} in the fixtures")
+    # Each 429 or 401 costs one retried request on top of the pages
+    budget = expected_requests + phase['throttled'] + phase['unauthorized']
+    if phase['list_requests'] > budget:
+        problems.append(f"{phase['list_requests']} list requests, expected at most {budget}")
+    return problems
+
+
+def _phase(seconds, elapsed, count, mock_stats, before):
+    result = {'seconds': elapsed, 'items': count, 'items_per_second': count / elapsed if elapsed else None,
+              'requests': len(seconds),
+              'list_requests': mock_stats['endpoints'].get(LIST_ENDPOINT, 0) - before['endpoints'].get(LIST_ENDPOINT, 0)}
+    if seconds:
+        p50, p95, p99 = np.percentile(seconds, [50, 95, 99])
+        result.update(p50_seconds=p50, p95_seconds=p95, p99_seconds=p99, max_seconds=max(seconds))
+    for key in ('throttled', 'unauthorized', 'refreshes'):
+        result[key] = mock_stats[key] - before[key]
+    return result
+
+
+def _snapshot(stats):
+    return dict(stats, endpoints=dict(stats['endpoints']))
+
+
+def run_workers(activities, workers, args):
+    rate_limit = None
+    if args.rate_limit:
+        requests, window = args.rate_limit.split('/')
+        rate_limit = (int(requests), float(window))
+    mock = MockStrava(activities, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, rate_limit=rate_limit,
+                      throttle_rate=args.throttle_rate, seed=args.seed)
+    server = MockStravaServer(mock, port=0).start()
+    os.environ.update(STRAVA_CLIENT_ID="1", STRAVA_CLIENT_SECRET="mock")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tokens = mock.issue_tokens(ttl_seconds=-60 if args.expired_token else None)
+        token_store = FileTokenStore(os.path.join(tmp, "tokens.json"))
+        token_store.save({k: tokens[k] for k in ('access_token', 'refresh_token', 'expires_at')})
+        # Strava's 15-minute window would stall a run for minutes after the mock's first 429;
+        # pace reads by the mock's own --rate-limit window instead, so a penalty lasts one of those
+        read_limiter = RateLimiter(limits=[rate_limit or (1000, 1)], headroom=1.0)
+        strava = StravaClient(store=ActivityStore(os.path.join(tmp, "activities.db")), token_store=token_store,
+                              rate_limiter=read_limiter, backoff_seconds=args.backoff, http_session=server.session())
+        result = {'workers': workers}
+
+        starts = sorted(a['start_date'] for a in activities)
+        after = datetime.datetime.strptime(starts[0][:7], "%Y-%m").replace(tzinfo=datetime.timezone.utc)
+        before = datetime.datetime.strptime(starts[-1][:10], "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc)
+        before += datetime.timedelta(days=1)
+
+        expected_ids = {a['id'] for a in activities if a['type'] == 'Ride'}
+        expected_requests = _list_requests(activities, after, before)
+        result['problems'] = []
+
+        before_stats = _snapshot(mock.stats)
+        seconds = _latencies(strava.auth.client)
+        start = time.perf_counter()
+        try:
+            rides = strava.fetch_rides_range(after, before, max_workers=workers)
+            result['fetch_error'] = None
+        except Exception as e:
+            rides, result['fetch_error'] = [], str(e)
+            result['problems'].append(f"fetch failed: {e}")
+        result['fetch'] = _phase(seconds, time.perf_counter() - start, len(rides), mock.stats, before_stats)
+        if not result['fetch_error']:
+            result['problems'] += [f"fetch: {p}" for p in _check_rides(result['fetch'], rides, expected_ids, expected_requests)]
+
+        # A second client on an empty store, so every page comes from the mock again
+        streamer = StravaClient(store=ActivityStore(os.path.join(tmp, "streamed.db")), token_store=token_store,
+                                rate_limiter=read_limiter, backoff_seconds=args.backoff, http_session=server.session())
+        before_stats = _snapshot(mock.stats)
+        stream_seconds = _latencies(streamer.auth.client)
+        start = time.perf_counter()
+        try:
+            streamed = [r for page in streamer.stream_rides_range(after, before, max_workers=workers) for r in page]
+            result['stream_error'] = None
+        except Exception as e:
+            streamed, result['stream_error'] = [], str(e)
+            result['problems'].append(f"stream failed: {e}")
+        result['stream'] = _phase(stream_seconds, time.perf_counter() - start, len(streamed), mock.stats, before_stats)
+        if not result['stream_error']:
+            result['problems'] += [f"stream: {p}" for p in _check_rides(result['stream'], streamed, expected_ids, expected_requests)]
+
+        ids = [r.id for r in rides[:args.edits]] or [a['id'] for a in activities[:args.edits]]
+        before_stats = _snapshot(mock.stats)
+        seconds.clear()
+        scheduler = EditScheduler(
+            strava.client, EditJournal(os.path.join(tmp, "journal.jsonl")),
+            # Strava's write limits would stretch a run over hours; the mock's rate limit stands in for them
+            rate_limiter=RateLimiter(limits=[(len(ids) or 1, 1)]),
+            max_workers=workers, backoff_seconds=args.backoff,
+        )
+        start = time.perf_counter()
+        summary = scheduler.run(ids, {'commute': True})
+        result['edit'] = _phase(seconds, time.perf_counter() - start, summary['success'], mock.stats, before_stats)
+        result['edit']['failed'] = summary['failed']
+        if summary['failed']:
+            result['problems'].append(f"edit: {summary['failed']} edits failed")
+    server.stop()
+    return result
+
+
+def _ms(value):
+    return "-" if value is None else f"{value * 1000:.0f}ms"
+
+
+def print_report(results):
+    print(f"{'workers':>7} {'phase':<6}{'wall':>9}{'items/s':>10}{'reqs':>7}{'p50':>8}{'p95':>8}{'p99':>8}"
+          f"{'max':>8}{'429s':>6}{'401s':>6}{'refresh':>8}")
+    for result in results:
+        for phase in PHASES:
+            p = result[phase]
+            rate = "-" if p['items_per_second'] is None else f"{p['items_per_second']:.0f}"
+            print(f"{result['workers']:>7} {phase:<6}{p['seconds']:>8.2f}s{rate:>10}{p['requests']:>7}"
+                  f"{_ms(p.get('p50_seconds')):>8}{_ms(p.get('p95_seconds')):>8}{_ms(p.get('p99_seconds')):>8}"
+                  f"{_ms(p.get('max_seconds')):>8}{p['throttled']:>6}{p['unauthorized']:>6}{p['refreshes']:>8}")
+        for problem in result['problems']:
+            print(f"{'':>7} {problem}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--activities', type=int, default=2000, help="Synthetic activities served by the mock")
+    parser.add_argument('--fixtures', help="Serve these Strava activity JSON fixtures instead")
+    parser.add_argument('--workers', type=int, nargs='+', default=DEFAULT_WORKERS)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--jitter-ms', type=float, default=50)
+    parser.add_argument('--rate-limit', help="Mock budget of REQUESTS/SECONDS per window, e.g. 100/5")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Probability of a 429 on any request")
+    parser.add_argument('--expired-token', action='store_true', help="Start with an expired access token")
+    parser.add_argument('--edits', type=int, default=200)
+    parser.add_argument('--backoff', type=float, default=0.2, help="EditScheduler base backoff seconds")
+    parser.add_argument('--json', help="Write results to this JSON file")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    activities = load_fixtures(args.fixtures) if args.fixtures else synthetic_activities(args.activities, seed=args.seed)
+    results = [run_workers(activities, workers, args) for workers in args.workers]
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': platform.python_version(), 'args': vars(args), 'results': results}, f, indent=4)
+    return 1 if any(result['problems'] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
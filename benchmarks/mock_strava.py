@@ -0,0 +1,344 @@
+"""Local stand-in for the Strava API, for exercising fetch, edit and token refresh offline.
+
+Serves the endpoints the app uses (athlete, activity list with pagination, activity
+detail and update, token refresh) from fixture activities, with configurable latency,
+429 rate-limit responses and access token expiry. benchmarks/load_test.py serves one
+in-process and builds its StravaClients on MockStravaServer.session(); it can also run
+standalone for manual requests:
+
+    python -m benchmarks.mock_strava --port 8765 --synthetic 2000 --latency-ms 50
+
+Rate-limit headers never report usage at the limit: stravalib would then sleep until
+the next quarter hour, while the mock's limit windows are only seconds long.
+"""
+import argparse
+import calendar
+import json
+import random
+import re
+import secrets
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.auth import HTTP_POOL_SIZE
+from src.synthetic import generate_rides
+
+MOCK_PORT = 8765
+# stravalib always talks to this origin; sessions from MockStravaServer.session() send it to the mock
+STRAVA_ORIGIN = "https://www.strava.com"
+MOCK_ATHLETE_ID = 1
+# Strava caps per_page at 200 (and defaults to 30)
+MAX_PER_PAGE = 200
+DEFAULT_PER_PAGE = 30
+# Lifetime of issued access tokens, as on Strava
+TOKEN_TTL_SECONDS = 6 * 3600
+# Limits advertised in the X-RateLimit-Limit header (15 minutes, daily)
+ADVERTISED_LIMITS = (600, 30000)
+# Fields accepted by PUT /activities/{id}
+UPDATABLE_FIELDS = ('commute', 'trainer', 'hide_from_home', 'name', 'type', 'sport_type', 'description', 'gear_id')
+
+_ACTIVITY_PATH = re.compile(r"^/api/v3/activities/(\d+)$")
+
+
+def activity_json(ride, athlete_id=MOCK_ATHLETE_ID):
+    """Strava API representation of a Ride record (summary fields)."""
+    start = ride.start_date.strftime("%Y-%m-%dT%H:%M:%SZ")
+    return {
+        "id": ride.id,
+        "resource_state": 2,
+        "athlete": {"id": athlete_id, "resource_state": 1},
+        "name": ride.name,
+        "type": ride.type,
+        "sport_type": ride.type,
+        "start_date": start,
+        "start_date_local": start,
+        "timezone": "(GMT+00:00) UTC",
+        "elapsed_time": int(ride.elapsed_seconds),
+        "moving_time": int(ride.elapsed_seconds),
+        "distance": ride.distance,
+        "start_latlng": list(ride.start_latlng) if ride.start_latlng else [],
+        "end_latlng": list(ride.end_latlng) if ride.end_latlng else [],
+        "map": {"id": f"a{ride.id}", "summary_polyline": ride.polyline or "", "resource_state": 2},
+        "commute": False,
+        "trainer": False,
+        "private": False,
+        "hide_from_home": False,
+    }
+
+
+def load_fixtures(path):
+    """Activities from a JSON file holding a list of Strava API activity objects."""
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_fixtures(path, activities):
+    with open(path, 'w') as f:
+        json.dump(activities, f)
+
+
+def synthetic_activities(n, seed=0, athlete_id=MOCK_ATHLETE_ID):
+    """n synthetic commute-heavy activities (see src.synthetic) in API form."""
+    return [activity_json(ride, athlete_id) for ride in generate_rides(n, seed=seed)]
+
+
+def _epoch(iso):
+    return calendar.timegm(time.strptime(iso, "%Y-%m-%dT%H:%M:%SZ"))
+
+
+class MockStrava:
+    """State and behaviour of the mock API, independent of HTTP.
+
+    latency_ms (+ up to jitter_ms) is added to every request. rate_limit=(requests,
+    window_seconds) answers 429 once a window's budget is spent, and throttle_rate is
+    the probability of a 429 on any request. Access tokens expire token_ttl_seconds
+    after they are issued (401 afterwards) until refreshed through /oauth/token.
+    """
+
+    def __init__(self, activities=(), athlete_id=MOCK_ATHLETE_ID, latency_ms=0, jitter_ms=0, rate_limit=None,
+                 throttle_rate=0.0, token_ttl_seconds=TOKEN_TTL_SECONDS, seed=0):
+        self.athlete_id = athlete_id
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_limit = rate_limit
+        self.throttle_rate = throttle_rate
+        self.token_ttl_seconds = token_ttl_seconds
+        self.rng = random.Random(seed)
+        self.activities = {int(a['id']): dict(a) for a in activities}
+        self._start_ts = {aid: _epoch(a['start_date']) for aid, a in self.activities.items()}
+        self._by_start = sorted(self.activities, key=self._start_ts.get)
+        self.access_tokens = {}
+        self.refresh_tokens = set()
+        self.stats = {'requests': 0, 'throttled': 0, 'unauthorized': 0, 'refreshes': 0, 'updates': 0, 'endpoints': {}}
+        self._window = (0.0, 0)
+        self._lock = threading.Lock()
+
+    def issue_tokens(self, ttl_seconds=None):
+        """A new token set as Strava's /oauth/token returns it; a negative ttl gives an already expired token."""
+        ttl = self.token_ttl_seconds if ttl_seconds is None else ttl_seconds
+        tokens = {
+            "token_type": "Bearer",
+            "access_token": secrets.token_hex(20),
+            "refresh_token": secrets.token_hex(20),
+            "expires_at": int(time.time() + ttl),
+            "expires_in": int(ttl),
+        }
+        with self._lock:
+            self.access_tokens[tokens['access_token']] = tokens['expires_at']
+            self.refresh_tokens.add(tokens['refresh_token'])
+        return tokens
+
+    def expire_tokens(self):
+        """Expire every access token now, as if they had all outlived their ttl."""
+        with self._lock:
+            self.access_tokens = {token: 0 for token in self.access_tokens}
+
+    def _rate_limited(self):
+        """Count a request against the limit window; True when it should get a 429."""
+        with self._lock:
+            self.stats['requests'] += 1
+            now = time.time()
+            if self.rate_limit:
+                limit, window_seconds = self.rate_limit
+                started, used = self._window
+                if now - started >= window_seconds:
+                    started, used = now, 0
+                self._window = (started, used + 1)
+                if used >= limit:
+                    return True
+            return self.rng.random() < self.throttle_rate
+
+    def rate_headers(self):
+        short_limit, long_limit = ADVERTISED_LIMITS
+        used = min(self._window[1], short_limit - 1)
+        total = min(self.stats['requests'], long_limit - 1)
+        return {"X-RateLimit-Limit": f"{short_limit},{long_limit}", "X-RateLimit-Usage": f"{used},{total}"}
+
+    def _authorized(self, header):
+        token = (header or "").removeprefix("Bearer ").strip()
+        with self._lock:
+            return self.access_tokens.get(token, 0) > time.time()
+
+    def handle(self, method, path, query, headers, body):
+        """(HTTP status, JSON body) for one request."""
+        delay = self.latency_ms + self.rng.uniform(0, self.jitter_ms)
+        if delay:
+            time.sleep(delay / 1000.0)
+        endpoint = f"{method} {_ACTIVITY_PATH.sub('/api/v3/activities/{id}', path)}"
+        with self._lock:
+            self.stats['endpoints'][endpoint] = self.stats['endpoints'].get(endpoint, 0) + 1
+
+        if path == "/oauth/token" and method == "POST":
+            return self._refresh(body)
+        if self._rate_limited():
+            with self._lock:
+                self.stats['throttled'] += 1
+            return 429, {"message": "Rate Limit Exceeded", "errors": [{"resource": "Application", "code": "exceeded"}]}
+        if not self._authorized(headers.get("Authorization")):
+            with self._lock:
+                self.stats['unauthorized'] += 1
+            return 401, {"message": "Authorization Error",
+                         "errors": [{"resource": "Athlete", "field": "access_token", "code": "invalid"}]}
+
+        if path == "/api/v3/athlete" and method == "GET":
+            return 200, {"id": self.athlete_id, "resource_state": 3, "firstname": "Mock", "lastname": "Athlete"}
+        if path == "/api/v3/athlete/activities" and method == "GET":
+            return 200, self._list(query)
+        match = _ACTIVITY_PATH.match(path)
+        if match:
+            activity = self.activities.get(int(match.group(1)))
+            if activity is None:
+                return 404, {"message": "Record Not Found", "errors": [{"resource": "Activity", "code": "not found"}]}
+            if method == "PUT":
+                with self._lock:
+                    activity.update({k: v for k, v in (body or {}).items() if k in UPDATABLE_FIELDS})
+                    self.stats['updates'] += 1
+            return 200, dict(activity, resource_state=3)
+        return 404, {"message": "Resource Not Found", "errors": []}
+
+    def _list(self, query):
+        """One page of activities, filtered by after/before (exclusive) like the real endpoint."""
+        after = float(query.get('after') or 0)
+        before = float(query.get('before') or float('inf'))
+        page = max(int(query.get('page') or 1), 1)
+        per_page = min(int(query.get('per_page') or DEFAULT_PER_PAGE), MAX_PER_PAGE)
+        ids = [aid for aid in self._by_start if after < self._start_ts[aid] < before]
+        if not query.get('after'):
+            ids.reverse()  # Newest first unless paging forward from `after`
+        return [self.activities[aid] for aid in ids[(page - 1) * per_page:page * per_page]]
+
+    def _refresh(self, form):
+        form = form or {}
+        with self._lock:
+            known = form.get('refresh_token') in self.refresh_tokens
+            if known:
+                self.refresh_tokens.discard(form['refresh_token'])
+                self.stats['refreshes'] += 1
+        if form.get('grant_type') != 'refresh_token' or not known:
+            return 400, {"message": "Bad Request", "errors": [{"resource": "RefreshToken", "code": "invalid"}]}
+        return 200, self.issue_tokens()
+
+
+class MockStravaServer:
+    """HTTP front end for a MockStrava, served from background threads."""
+
+    def __init__(self, mock, host="127.0.0.1", port=MOCK_PORT):
+        self.mock = mock
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    @property
+    def url(self):
+        return f"http://{self.httpd.server_address[0]}:{self.port}"
+
+    def session(self):
+        """requests Session that sends the app's Strava requests to this server (StravaClient(http_session=...))."""
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        url = self.url
+
+        class RedirectingAdapter(HTTPAdapter):
+            def send(self, request, **kwargs):
+                if request.url.startswith(STRAVA_ORIGIN):
+                    request.url = url + request.url[len(STRAVA_ORIGIN):]
+                return super().send(request, **kwargs)
+
+        session = requests.Session()
+        adapter = RedirectingAdapter(pool_connections=2, pool_maxsize=HTTP_POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _handler(self):
+        mock = self.mock
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+
+            def _dispatch(self, method):
+                url = urllib.parse.urlparse(self.path)
+                query = dict(urllib.parse.parse_qsl(url.query))
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if "json" in (self.headers.get("Content-Type") or ""):
+                    body = json.loads(raw or b"null")
+                else:
+                    body = dict(urllib.parse.parse_qsl(raw.decode()))
+                status, payload = mock.handle(method, url.path, query, self.headers, body)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in mock.rate_headers().items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def do_PUT(self):
+                self._dispatch("PUT")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=MOCK_PORT)
+    parser.add_argument('--fixtures', help="JSON list of Strava activities to serve")
+    parser.add_argument('--synthetic', type=int, default=1000, help="Synthetic activities to serve without --fixtures")
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--rate-limit', help="REQUESTS/SECONDS budget per window, e.g. 100/15")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Probability of a 429 on any request")
+    parser.add_argument('--token-ttl', type=int, default=TOKEN_TTL_SECONDS)
+    parser.add_argument('--token-file', help="Write a freshly issued token set here (for FileTokenStore)")
+    args = parser.parse_args(argv)
+
+    activities = load_fixtures(args.fixtures) if args.fixtures else synthetic_activities(args.synthetic)
+    rate_limit = None
+    if args.rate_limit:
+        requests, seconds = args.rate_limit.split('/')
+        rate_limit = (int(requests), float(seconds))
+    mock = MockStrava(activities, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, rate_limit=rate_limit,
+                      throttle_rate=args.throttle_rate, token_ttl_seconds=args.token_ttl)
+    if args.token_file:
+        tokens = mock.issue_tokens()
+        with open(args.token_file, 'w') as f:
+            json.dump({k: tokens[k] for k in ('access_token', 'refresh_token', 'expires_at')}, f)
+
+    server = MockStravaServer(mock, host=args.host, port=args.port)
+    print(f"Mock Strava API with {len(activities)} activities on {server.url} (Ctrl+C to stop)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
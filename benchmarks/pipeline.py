@@ -0,0 +1,122 @@
+"""Offline benchmark of the commute analysis pipeline on synthetic rides.
+
+Usage:
+    python -m benchmarks.pipeline [--sizes 1000 10000] [--snap-meters 20] [--json results.json] [--no-memory]
+
+For each size, every stage is timed on its own, then re-run under tracemalloc to
+record its peak Python/NumPy allocation. Results print as a table and can be
+written as JSON for tracking in CI.
+
+Locations are estimated with exact DBSCAN, as in the app, unless --snap-meters
+turns on LocationAnalyzer's grid snapping. Exact clustering needs memory that
+grows with the square of the points per cluster, so sizes of ~30k rides and up
+need snapping to finish.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from src.commute_detector import CommuteDetector
+from src.location_analyzer import LocationAnalyzer
+from src.rides import RideTable
+from src.synthetic import generate_rides
+from src.visualizations import create_commute_heatmap
+
+DEFAULT_SIZES = [1000, 10000]
+
+
+def _stages(rides, snap_meters=None):
+    """Ordered (name, callable) pairs; each callable receives the previous stage outputs."""
+    state = {}
+
+    def build_table():
+        state['table'] = RideTable(rides)
+
+    def estimate_locations():
+        state['home'], state['work'] = LocationAnalyzer(snap_meters=snap_meters).estimate_locations(state['table'])
+
+    def detect_commutes():
+        state['detector'] = CommuteDetector(state['home'], state['work'])
+        state['commutes'] = state['detector'].detect_commutes(state['table'])
+
+    def detect_chained_commutes():
+        state['detector'].detect_chained_commutes(state['table'].rides)
+
+    def create_heatmap():
+        create_commute_heatmap(state['commutes'])
+
+    return [
+        ('build_table', build_table),
+        ('estimate_locations', estimate_locations),
+        ('detect_commutes', detect_commutes),
+        ('detect_chained_commutes', detect_chained_commutes),
+        ('create_commute_heatmap', create_heatmap),
+    ], state
+
+
+def run_size(n, measure_memory=True, seed=0, snap_meters=None):
+    start = time.perf_counter()
+    rides = generate_rides(n, seed=seed)
+    result = {'size': n, 'generate_seconds': time.perf_counter() - start, 'stages': {}, 'snap_meters': snap_meters}
+
+    stages, state = _stages(rides, snap_meters)
+    for name, stage in stages:
+        start = time.perf_counter()
+        stage()
+        elapsed = time.perf_counter() - start
+
+        peak = None
+        if measure_memory:
+            tracemalloc.start()
+            stage()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        result['stages'][name] = {'seconds': elapsed, 'peak_bytes': peak}
+
+    result['total_seconds'] = sum(s['seconds'] for s in result['stages'].values())
+    peaks = [s['peak_bytes'] for s in result['stages'].values() if s['peak_bytes'] is not None]
+    result['peak_bytes'] = max(peaks) if peaks else None
+    result['commutes'] = len(state.get('commutes', []))
+    return result
+
+
+def _format_bytes(n):
+    return "-" if n is None else f"{n / 1e6:.1f} MB"
+
+
+def print_report(results):
+    for result in results:
+        clustering = f"{result['snap_meters']:g} m grid" if result['snap_meters'] else "exact clustering"
+        print(f"\n== {result['size']:,} activities "
+              f"(generated in {result['generate_seconds']:.2f}s, {result['commutes']:,} commutes, {clustering}) ==")
+        print(f"{'stage':<26}{'wall time':>12}{'peak memory':>14}")
+        for name, stage in result['stages'].items():
+            print(f"{name:<26}{stage['seconds']:>11.3f}s{_format_bytes(stage['peak_bytes']):>14}")
+        print(f"{'total':<26}{result['total_seconds']:>11.3f}s{_format_bytes(result['peak_bytes']):>14}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--json', help="Write results to this JSON file")
+    parser.add_argument('--no-memory', action='store_true', help="Skip the tracemalloc pass")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--snap-meters', type=float, help="Cluster on a grid of this size instead of exactly")
+    args = parser.parse_args(argv)
+
+    results = [run_size(n, measure_memory=not args.no_memory, seed=args.seed, snap_meters=args.snap_meters)
+               for n in args.sizes]
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': platform.python_version(), 'results': results}, f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
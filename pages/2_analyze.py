@@ -1,13 +1,18 @@
 import streamlit as st
 import datetime
-import pandas as pd
-from src.strava_client import StravaClient
+from src.strava_client import StravaClient, month_bounds
 from src.location_analyzer import LocationAnalyzer
-from src.commute_detector import CommuteDetector
+from src.anchors import parse_anchor_lines, parse_pairs
+from src.location_model import rebuild_locations, update_locations
+from src.rides import RideTable
+from src.instrumentation import instrumentation
+from src.analysis_cache import AnalysisCache
 from src.log_manager import LogManager
-from src.visualizations import create_commute_heatmap, plot_commute_stats, plot_day_distribution
-import folium
-from streamlit_folium import st_folium
+from src.export import EXPORT_DIR, export_parquet
+from src.frames import commute_frame, commute_rollups
+from src.route_index import athlete_route_index
+from src.pipeline import DEFAULT_MAX_GAP_HOURS, DEFAULT_RADIUS_METERS, analyze, flatten_commutes, month_logs
+from src.visualizations import create_commute_heatmap, create_overview_map, plot_commute_stats, plot_day_distribution
 
 st.title("🔍 Activity Analysis")
 
@@ -17,17 +22,7 @@ if 'strava' not in st.session_state or not st.session_state.strava.is_authentica
 
 strava = st.session_state.strava
 analyzer = LocationAnalyzer()
-lm = LogManager()
-
-def safe_latlng(ll):
-    if ll is None: return None
-    try:
-        return [float(ll[0]), float(ll[1])]
-    except (TypeError, KeyError, IndexError, AttributeError):
-        try:
-            return [float(getattr(ll, 'lat')), float(getattr(ll, 'lon', getattr(ll, 'lng')))]
-        except:
-            return None
+lm = LogManager(strava.get_athlete_id())
 
 # Sidebar for controls
 with st.sidebar:
@@ -36,32 +31,122 @@ with st.sidebar:
     default_year = today.year
     default_month = today.month
     
-    year = st.selectbox("Year", range(2020, default_year + 1), index=(default_year - 2020))
-    month = st.selectbox("Month", range(1, 13), index=(default_month - 1))
+    st.subheader("From")
+    start_year = st.selectbox("Start Year", range(2020, default_year + 1), index=(default_year - 2020))
+    start_month = st.selectbox("Start Month", range(1, 13), index=(default_month - 1))
+    st.subheader("To")
+    end_year = st.selectbox("End Year", range(2020, default_year + 1), index=(default_year - 2020))
+    end_month = st.selectbox("End Month", range(1, 13), index=(default_month - 1))
     
-    radius = st.slider("Detection Radius (meters)", 50, 1000, 300)
-    max_gap = st.slider("Max Stop Duration (hours)", 1, 12, 6)
-
-if st.button("Fetch and Analyze Activities"):
-    with st.spinner(f"Fetching activities for {year}-{month:02d}..."):
-        try:
-            rides = strava.fetch_rides(year, month)
-            st.session_state.current_rides = rides
-            
-            if not rides:
-                st.warning("No rides found for this month.")
-            else:
-                home, work = analyzer.estimate_locations(rides)
-                st.session_state.home = home
-                st.session_state.work = work
-                st.session_state.analysis_done = True
-        except Exception as e:
-            st.error(f"Failed to fetch activities: {e}")
-            if "Unauthorized" in str(e):
-                st.info("This is likely due to missing permissions. Please go to the **Authentication** page, click **Disconnect**, and then **Connect with Strava** again, making sure to check all permission boxes.")
+    radius = st.slider("Detection Radius (meters)", 50, 1000, DEFAULT_RADIUS_METERS)
+    max_gap = st.slider("Max Stop Duration (hours)", 1, 12, DEFAULT_MAX_GAP_HOURS)
+    exclude_detours = st.checkbox("Exclude detours", help="Drop single-ride commutes that are not on one of your usual routes")
+
+    with st.expander("Extra Anchors"):
+        anchor_text = st.text_area(
+            "Anchors (one per line)", placeholder="Office 2, work, 47.51, 19.08, 250\nStation, station, 47.50, 19.08",
+            help="name, category, lat, lng[, radius in meters]. Home and Work above are always included.",
+        )
+        pairs_text = st.text_input("Commute pairs", "home-work", help="Comma-separated category pairs, either direction")
+    extra_anchors, anchor_errors = parse_anchor_lines(anchor_text, default_radius=radius)
+    commute_pairs = parse_pairs(pairs_text)
+    for error in anchor_errors:
+        st.error(error)
+
+    st.subheader("Home/Work Model")
+    recluster = st.button("Re-cluster full history",
+                          help="Rebuild the saved home/work model from every stored ride instead of updating it incrementally")
+
+range_after, _ = month_bounds(start_year, start_month)
+_, range_before = month_bounds(end_year, end_month)
+range_label = f"{start_year}-{start_month:02d}"
+if (end_year, end_month) != (start_year, start_month):
+    range_label += f" to {end_year}-{end_month:02d}"
+
+# Most recent rides shown while a fetch is streaming in
+PREVIEW_ROWS = 20
+
+
+def analyze_fetched(fetched, edge_rides=(), partial=False):
+    rides = RideTable(fetched)
+    st.session_state.current_rides = rides
+    st.session_state.edge_rides = RideTable(edge_rides)
+    # A stopped fetch misses rides of some months, so its results must not overwrite their logs
+    st.session_state.fetch_was_partial = partial
+
+    if not rides:
+        st.warning("No rides found for this period.")
+    else:
+        # Fold the new rides into the athlete's saved model; only their points are clustered
+        athlete_id = strava.get_athlete_id()
+        if athlete_id is not None:
+            home, work = update_locations(athlete_id, rides, analyzer=analyzer)
+        else:
+            home, work = analyzer.estimate_locations(rides)
+        st.session_state.home = home
+        st.session_state.work = work
+        st.session_state.analysis_done = True
+
+
+if recluster:
+    athlete_id = strava.get_athlete_id()
+    if athlete_id is None:
+        st.sidebar.error("Could not determine the athlete to re-cluster.")
+    else:
+        with st.spinner("Re-clustering all stored rides..."):
+            history = strava.store.get_activities(athlete_id, 0, float('inf'), activity_type='Ride')
+            home, work = rebuild_locations(athlete_id, history, analyzer=analyzer)
+        if st.session_state.get('analysis_done'):
+            st.session_state.home = home
+            st.session_state.work = work
+        st.sidebar.success(f"Re-clustered {len(history)} stored rides.")
+
+# A fetch interrupted by a rerun (the Stop button or any other control) leaves its pages here
+if 'fetch_partial' in st.session_state:
+    partial = st.session_state.pop('fetch_partial')
+    st.info(f"Fetch stopped after {len(partial)} rides; analyzing the rides fetched so far.")
+    analyze_fetched(partial, partial=True)
+
+if range_after >= range_before:
+    st.sidebar.error("The end month must not be before the start month.")
+elif st.button("Fetch and Analyze Activities"):
+    # Clicking it reruns the page, which abandons the stream below after its current page
+    st.button("Stop fetching")
+    progress = st.progress(0.0, text=f"Fetching activities for {range_label}...")
+    preview = st.empty()
+    fetched = []
+    preview_rows = []
+    st.session_state.fetch_partial = fetched
+
+    def on_progress(count, months_done, months_total):
+        progress.progress(months_done / months_total, text=f"{count} rides fetched ({months_done}/{months_total} months)")
+
+    try:
+        for page in strava.stream_rides_range(range_after, range_before, progress_callback=on_progress):
+            fetched.extend(page)
+            preview_rows.extend(
+                {"Date": r.start_date.strftime("%Y-%m-%d %H:%M"), "Name": r.name, "Distance (km)": f"{r.distance / 1000.0:.2f}"}
+                for r in page
+            )
+            preview.dataframe(preview_rows[-PREVIEW_ROWS:])
+        # Rides just outside the window let chains crossing its edges be detected
+        edge_rides = strava.fetch_edge_rides(range_after, range_before)
+        del st.session_state.fetch_partial
+        progress.empty()
+        preview.empty()
+        analyze_fetched(fetched, edge_rides)
+    except Exception as e:
+        st.session_state.pop('fetch_partial', None)
+        st.error(f"Failed to fetch activities: {e}")
+        if "Unauthorized" in str(e):
+            st.info("This is likely due to missing permissions. Please go to the **Authentication** page, click **Disconnect**, and then **Connect with Strava** again, making sure to check all permission boxes.")
 
 if 'analysis_done' in st.session_state and st.session_state.analysis_done:
+    # Rendering libraries are only needed once there is something to show
+    from streamlit_folium import st_folium
+
     rides = st.session_state.current_rides
+    edge_rides = st.session_state.get('edge_rides') or RideTable([])
     home = st.session_state.home
     work = st.session_state.work
     
@@ -76,101 +161,86 @@ if 'analysis_done' in st.session_state and st.session_state.analysis_done:
         else:
             st.info("Could not reliably estimate a second cluster for Work. You can select it manually.")
 
+    # Stage results are memoized across reruns, keyed by the inputs each stage depends on
+    if 'analysis_cache' not in st.session_state:
+        st.session_state.analysis_cache = AnalysisCache()
+    cache = st.session_state.analysis_cache
+    rides_key = rides.fingerprint()
+
     # Map for location selection/verification
     st.subheader("Map Overview")
-    m = folium.Map(location=home if home else [0,0], zoom_start=13)
-    if home:
-        folium.Marker(home, tooltip="Home", icon=folium.Icon(color='blue', icon='home')).add_to(m)
-    if work:
-        folium.Marker(work, tooltip="Work", icon=folium.Icon(color='red', icon='briefcase')).add_to(m)
-    
-    # Optional: Plot activity starts/ends
-    for r in rides:
-        start = safe_latlng(r.start_latlng)
-        if start:
-            folium.CircleMarker(start, radius=3, color='green', fill=True).add_to(m)
-        end = safe_latlng(r.end_latlng)
-        if end:
-            folium.CircleMarker(end, radius=3, color='orange', fill=True).add_to(m)
-
+    anchors_key = tuple((a.name, a.category, a.lat, a.lng, a.radius_meters) for a in extra_anchors)
+    m = cache.get_or_compute('overview_map', (rides_key, home, work, anchors_key),
+                             lambda: create_overview_map(rides, home, work, anchors=extra_anchors))
     st_folium(m, width=700, height=400)
 
     # Commute Detection
     if home and work:
-        detector = CommuteDetector(home, work, radius_meters=radius, max_time_gap_hours=max_gap)
-        commutes = detector.detect_commutes(rides)
+        detection_key = (rides_key, edge_rides.fingerprint(), radius, max_gap, home, work,
+                         anchors_key, tuple(commute_pairs), exclude_detours)
+
+        def detect():
+            # Usual routes come from the athlete's stored rides, not only this window's
+            athlete_id = strava.get_athlete_id() if exclude_detours else None
+            route_index = athlete_route_index(athlete_id, strava.store, rides) if athlete_id is not None else None
+            return analyze(rides, radius_meters=radius, max_time_gap_hours=max_gap, home=home, work=work,
+                           edge_rides=edge_rides.rides, anchors=extra_anchors, commute_pairs=commute_pairs,
+                           exclude_detours=exclude_detours, route_index=route_index)
+
+        result = cache.get_or_compute('detection', detection_key, detect)
+        commutes = result['commutes']
         
         st.subheader("Commute Statistics")
         st.metric("Total Rides", len(rides))
         
         # Flatten combined rides for stats
-        all_commute_activities = []
-        for c in commutes:
-            if isinstance(c, list):
-                all_commute_activities.extend(c)
-            else:
-                all_commute_activities.append(c)
+        all_commute_activities = flatten_commutes(commutes)
         
         st.metric("Commute Activities identified", len(all_commute_activities))
+        if exclude_detours:
+            st.metric("Detours excluded", len(result['detours']))
         
-        # Create a table of commutes
-        commute_data = []
-        for c in commutes:
-            if isinstance(c, list):
-                ids = [r.id for r in c]
-                names = ", ".join([r.name for r in c])
-                dist = sum([float(r.distance) for r in c]) / 1000.0
-                date = c[0].start_date.strftime("%Y-%m-%d %H:%M")
-                type_str = "Chained"
-            else:
-                ids = [c.id]
-                names = c.name
-                dist = float(c.distance) / 1000.0
-                date = c.start_date.strftime("%Y-%m-%d %H:%M")
-                type_str = "Simple"
-            
-            commute_data.append({
-                "Date": date,
-                "Type": type_str,
-                "Distance (km)": f"{dist:.2f}",
-                "Name": names,
-                "IDs": ids
-            })
-        
-        df = pd.DataFrame(commute_data)
-        st.dataframe(df)
+        # Typed commute table and its period rollups, built once per detection result
+        def build_table():
+            with instrumentation.span('table', commutes=len(commutes)):
+                frame = commute_frame(commutes)
+                return frame, commute_rollups(frame)
+
+        df, rollups = cache.get_or_compute('table', detection_key, build_table)
+        st.dataframe(df, column_config={
+            'Date': st.column_config.DatetimeColumn(format="YYYY-MM-DD HH:mm"),
+            'Distance (km)': st.column_config.NumberColumn(format="%.2f"),
+        })
+
+        def build_charts():
+            return plot_commute_stats(rollups), plot_day_distribution(rollups)
 
         st.subheader("Visualizations")
         tab1, tab2 = st.tabs(["Heatmap", "Statistics"])
         
         with tab1:
             st.markdown("### Geo Heatmap of Commutes")
-            hmap = create_commute_heatmap(commutes)
+            hmap = cache.get_or_compute('heatmap', detection_key, lambda: create_commute_heatmap(commutes))
             st_folium(hmap, width=700, height=500, key="heatmap")
             
         with tab2:
             st.markdown("### Commute Trends")
-            df['Distance (km)'] = df['Distance (km)'].astype(float)
-            fig1 = plot_commute_stats(df)
+            fig1, fig2 = cache.get_or_compute('charts', detection_key, build_charts)
             if fig1: st.plotly_chart(fig1, width='stretch')
             
-            fig2 = plot_day_distribution(df)
             if fig2: st.plotly_chart(fig2, width='stretch')
 
-        if st.button("Save results to Log"):
-            log_data = {
-                "analysis_timestamp": datetime.datetime.now().isoformat(),
-                "home": home,
-                "work": work,
-                "commutes_count": len(commutes),
-                "commute_activity_ids": [id for d in commute_data for id in d['IDs']],
-                "statistics": {
-                    "total_rides": len(rides),
-                    "total_commute_activities": len(all_commute_activities),
-                    "total_distance_km": sum([float(d['Distance (km)']) for d in commute_data])
-                }
-            }
-            lm.upsert_log(year, month, log_data)
-            st.success(f"Log updated for {year}-{month:02d}!")
+        save_col, export_col = st.columns(2)
+        partial_fetch = st.session_state.get('fetch_was_partial', False)
+        if save_col.button("Save results to Log", disabled=partial_fetch,
+                           help="Fetch the whole range again to save it; this fetch was stopped" if partial_fetch else None):
+            # One log per calendar month; a commute belongs to the month it starts in
+            for (log_year, log_month), log_data in month_logs(rides, commutes, home, work).items():
+                lm.upsert_log(log_year, log_month, log_data)
+            st.success(f"Log updated for {range_label}!")
+        if export_col.button("Export rides to Parquet",
+                             help=f"Write every analysed ride with its commute label to {EXPORT_DIR}, partitioned by month"):
+            partitions = export_parquet(rides, commutes, result['anchors'], strava.get_athlete_id(), result['detours'])
+            st.success(f"Exported {len(rides)} rides ({len(partitions)} months) to {EXPORT_DIR}")
     else:
         st.warning("Need both Home and Work locations to detect commutes.")
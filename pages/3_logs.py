@@ -1,11 +1,25 @@
 import streamlit as st
 from src.log_manager import LogManager
-import pandas as pd
-import json
 
 st.title("📂 Analysis Logs")
 
-lm = LogManager()
+if 'strava' not in st.session_state or not st.session_state.strava.is_authenticated():
+    st.warning("Please authenticate first!")
+    st.stop()
+
+strava = st.session_state.strava
+athlete_id = strava.get_athlete_id()
+lm = LogManager(athlete_id)
+
+# Logs saved before storage was split per athlete can be claimed once they are shown to be
+# this athlete's: every commute they list must be one of the athlete's fetched activities
+if athlete_id is not None and lm.unassigned_count():
+    verified = lm.verified_unassigned(strava.store.activity_ids(athlete_id))
+    if verified:
+        st.info(f"{len(verified)} of your logs were saved before logs were stored per athlete.")
+        if st.button("Import them into my logs"):
+            st.success(f"Imported {lm.claim_unassigned(verified)} logs.")
+
 logs = lm.list_logs()
 
 if not logs:
@@ -1,7 +1,6 @@
 import streamlit as st
 from src.strava_client import StravaClient
 from src.log_manager import LogManager
-import datetime
 
 st.title("⚙️ Mass Edit Activities")
 
@@ -10,7 +9,7 @@ if 'strava' not in st.session_state or not st.session_state.strava.is_authentica
     st.stop()
 
 strava = st.session_state.strava
-lm = LogManager()
+lm = LogManager(strava.get_athlete_id())
 logs = lm.list_logs()
 
 if not logs:
@@ -36,28 +35,29 @@ else:
             if not activity_ids:
                 st.error("No activities to edit.")
             else:
+                # Note: 'visibility' might be tricky depending on API level.
+                # Followers only usually maps to 'followers_only', which the
+                # update endpoint does not accept; simplified here for the demo.
+                update_params = strava.build_update_params(
+                    commute=True if add_commute_flair else None,
+                )
+                journal_name = f"{selected_log['year']}-{selected_log['month']:02d}"
+                scheduler = strava.create_edit_scheduler(journal_name, update_params)
+
                 progress_bar = st.progress(0)
                 status_text = st.empty()
-                success_count = 0
-                
-                for i, aid in enumerate(activity_ids):
-                    status_text.text(f"Updating activity {aid}...")
-                    
-                    # Note: 'visibility' might be tricky depending on API level.
-                    # Stravalib usually handles it if passed correctly.
-                    # Followers only usually maps to 'followers_only' in update call.
-                    
-                    success = strava.update_activity(
-                        aid, 
-                        commute=True if add_commute_flair else None,
-                        # visibility might be a different param or requiring a raw request
-                        # simplified here for the demo
-                    )
-                    
-                    if success:
-                        success_count += 1
-                    
-                    progress_bar.progress((i + 1) / len(activity_ids))
-                
+                status_text.text(f"Updating {len(activity_ids)} activities...")
+
+                def on_progress(done, total):
+                    progress_bar.progress(done / total if total else 1.0)
+                    status_text.text(f"Updated {done} of {total} pending activities...")
+
+                summary = scheduler.run(activity_ids, update_params, progress_callback=on_progress)
+                success_count = summary['success'] + summary['skipped']
+
                 status_text.text(f"Done! Successfully updated {success_count} activities.")
-                st.success(f"Updated {success_count} of {len(activity_ids)} activities on Strava.")
+                if summary['skipped']:
+                    st.info(f"Resumed batch: {summary['skipped']} activities were already updated in a previous run.")
+                if summary['failed']:
+                    st.warning(f"{summary['failed']} activities failed and will be retried next time you apply changes.")
+                st.success(f"Updated {success_count} of {len(set(activity_ids))} activities on Strava.")
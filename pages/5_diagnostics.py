@@ -0,0 +1,75 @@
+import streamlit as st
+import datetime
+from src.auth import is_operator
+from src.instrumentation import instrumentation
+
+st.title("🩺 Diagnostics")
+
+if 'strava' not in st.session_state or not st.session_state.strava.is_authenticated():
+    st.warning("Please authenticate first!")
+    st.stop()
+
+# The stats cover every user of this server process, so only its operators see or change them
+if not is_operator(st.session_state.strava.get_athlete_id()):
+    st.info("Diagnostics cover all users of this server and are only available to its operators "
+            "(athlete ids listed in `STRAVA_OPERATOR_IDS`).")
+    st.stop()
+
+st.markdown("""
+Timing spans and counters for fetching, clustering, commute detection, table building
+and map rendering, plus every Strava API call made by this server process.
+""")
+
+enabled = st.toggle("Enable instrumentation", value=instrumentation.enabled)
+if enabled != instrumentation.enabled:
+    instrumentation.enabled = enabled
+    st.rerun()
+
+if not instrumentation.enabled:
+    st.info("Instrumentation is disabled. Enable it (or set `STRAVA_INSTRUMENTATION=1`) and run an analysis.")
+
+snapshot = instrumentation.snapshot()
+
+st.subheader("Pipeline Stages")
+summary = instrumentation.summary()
+if summary:
+    st.dataframe(summary, hide_index=True)
+else:
+    st.write("No spans recorded yet.")
+
+st.subheader("Strava API")
+col1, col2 = st.columns(2)
+col1.metric("API Requests", snapshot['counters'].get('api.requests', 0))
+col2.metric(
+    "Store Hits / Misses",
+    f"{snapshot['counters'].get('fetch.store_hits', 0)} / {snapshot['counters'].get('fetch.store_misses', 0)}"
+)
+
+if snapshot['api_calls']:
+    calls = [
+        {
+            "Endpoint": endpoint,
+            "Calls": stats['calls'],
+            "Mean Latency (s)": stats['seconds'] / stats['calls'],
+            "Status Codes": ", ".join(f"{code}: {n}" for code, n in sorted(stats['status'].items())),
+        }
+        for endpoint, stats in snapshot['api_calls'].items()
+    ]
+    st.dataframe(calls, hide_index=True)
+
+rate_limits = snapshot['rate_limits']
+if rate_limits:
+    seen_at = datetime.datetime.fromtimestamp(rate_limits.pop('seen_at'))
+    st.write(f"**Latest rate-limit headers** (seen {seen_at:%H:%M:%S}):")
+    st.json(rate_limits)
+
+with st.expander("Counters"):
+    st.json(snapshot['counters'])
+
+st.subheader("Export")
+col1, col2, col3 = st.columns(3)
+col1.download_button("⬇️ JSON", instrumentation.to_json(), file_name="diagnostics.json", mime="application/json")
+col2.download_button("⬇️ Spans CSV", instrumentation.to_csv(), file_name="spans.csv", mime="text/csv")
+if col3.button("🗑️ Reset"):
+    instrumentation.reset()
+    st.rerun()
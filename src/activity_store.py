@@ -0,0 +1,217 @@
+import datetime
+import os
+import sqlite3
+import time
+from contextlib import closing
+from .rides import Ride
+
+STORE_PATH = "data/activities.db"
+
+# Activities are sometimes uploaded a while after they start (late device sync),
+# so a window only counts as complete once it was synced this long after it ended.
+SYNC_GRACE_SECONDS = 2 * 24 * 3600
+# A webhook receiver's marker lapses if its heartbeat is older than this (e.g. it crashed)
+WEBHOOK_MAX_AGE_SECONDS = 5 * 60
+
+SCHEMA_VERSION = 3
+
+RIDE_COLUMNS = ("id, start_ts, type, name, elapsed_seconds, distance, "
+                "start_lat, start_lng, end_lat, end_lng, polyline")
+
+
+def _ride_from_row(row):
+    (id, start_ts, type, name, elapsed_seconds, distance,
+     start_lat, start_lng, end_lat, end_lng, polyline) = row
+    return Ride(
+        id=id, name=name, type=type,
+        start_date=datetime.datetime.fromtimestamp(start_ts, datetime.timezone.utc),
+        elapsed_seconds=elapsed_seconds, distance=distance,
+        start_lat=start_lat, start_lng=start_lng, end_lat=end_lat, end_lng=end_lng,
+        polyline=polyline,
+    )
+
+
+class ActivityStore:
+    """SQLite-backed local cache of compact Ride records with per-athlete sync cursors."""
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < 2:
+                # Earlier layouts held raw model JSON; the store is a cache, so start over
+                conn.executescript("""
+                    DROP TABLE IF EXISTS activities;
+                    DROP TABLE IF EXISTS sync_windows;
+                """)
+            if version < SCHEMA_VERSION:
+                # The webhook marker is kept per athlete; a running receiver recreates it on its next heartbeat
+                conn.execute("DROP TABLE IF EXISTS webhook_status")
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS activities (
+                    athlete_id INTEGER NOT NULL,
+                    id INTEGER NOT NULL,
+                    start_ts REAL NOT NULL,
+                    type TEXT,
+                    name TEXT,
+                    elapsed_seconds REAL,
+                    distance REAL,
+                    start_lat REAL,
+                    start_lng REAL,
+                    end_lat REAL,
+                    end_lng REAL,
+                    polyline TEXT,
+                    PRIMARY KEY (athlete_id, id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_activities_start
+                    ON activities (athlete_id, start_ts);
+                CREATE TABLE IF NOT EXISTS sync_windows (
+                    athlete_id INTEGER NOT NULL,
+                    after_ts INTEGER NOT NULL,
+                    before_ts INTEGER NOT NULL,
+                    synced_until INTEGER NOT NULL,
+                    PRIMARY KEY (athlete_id, after_ts, before_ts)
+                );
+                CREATE TABLE IF NOT EXISTS webhook_status (
+                    athlete_id INTEGER PRIMARY KEY,
+                    live_since INTEGER NOT NULL,
+                    heartbeat INTEGER NOT NULL
+                );
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def upsert_activities(self, athlete_id, rides):
+        """Insert or replace Ride records for an athlete."""
+        rows = [
+            (athlete_id, r.id, r.start_date.timestamp(), r.type, r.name, r.elapsed_seconds, r.distance,
+             r.start_lat, r.start_lng, r.end_lat, r.end_lng, r.polyline)
+            for r in rides
+        ]
+        if not rows:
+            return 0
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO activities (athlete_id, {RIDE_COLUMNS}) VALUES ({', '.join('?' * 12)})",
+                rows,
+            )
+        return len(rows)
+
+    def get_activities(self, athlete_id, after_ts, before_ts, activity_type=None):
+        """Load cached rides with after_ts <= start < before_ts, oldest first."""
+        query = f"SELECT {RIDE_COLUMNS} FROM activities WHERE athlete_id = ? AND start_ts >= ? AND start_ts < ?"
+        params = [athlete_id, after_ts, before_ts]
+        if activity_type is not None:
+            query += " AND type = ?"
+            params.append(activity_type)
+        query += " ORDER BY start_ts"
+        with closing(self._connect()) as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [_ride_from_row(row) for row in rows]
+
+    def get_activity(self, athlete_id, activity_id):
+        """A single cached ride, or None."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                f"SELECT {RIDE_COLUMNS} FROM activities WHERE athlete_id = ? AND id = ?", (athlete_id, activity_id)
+            ).fetchone()
+        return _ride_from_row(row) if row else None
+
+    def activity_ids(self, athlete_id):
+        """Ids of every activity cached for an athlete."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT id FROM activities WHERE athlete_id = ?", (athlete_id,)).fetchall()
+        return {row[0] for row in rows}
+
+    def delete_activity(self, athlete_id, activity_id):
+        with closing(self._connect()) as conn, conn:
+            return conn.execute(
+                "DELETE FROM activities WHERE athlete_id = ? AND id = ?", (athlete_id, activity_id)
+            ).rowcount
+
+    def delete_athlete(self, athlete_id):
+        """Forget everything cached for an athlete (e.g. after they deauthorize the app)."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM activities WHERE athlete_id = ?", (athlete_id,))
+            conn.execute("DELETE FROM sync_windows WHERE athlete_id = ?", (athlete_id,))
+
+    def invalidate(self, athlete_id, since_ts):
+        """Forget the sync state of windows ending after since_ts, so they are fetched again."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM sync_windows WHERE athlete_id = ? AND before_ts > ?", (athlete_id, since_ts))
+
+    def webhook_live_since(self, athlete_id, now=None):
+        """Since when webhook events have kept the athlete's rides up to date, or None if no
+        receiver has sent a heartbeat within WEBHOOK_MAX_AGE_SECONDS."""
+        now = time.time() if now is None else now
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT live_since, heartbeat FROM webhook_status WHERE athlete_id = ?", (athlete_id,)
+            ).fetchone()
+        if row is None or now - row[1] > WEBHOOK_MAX_AGE_SECONDS:
+            return None
+        return row[0]
+
+    def webhook_heartbeat(self, now=None):
+        """Record that webhook events are being applied for every athlete with synced windows.
+
+        Athletes seen for the first time, or whose marker had lapsed, count as live from now.
+        """
+        now = int(time.time()) if now is None else int(now)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                INSERT INTO webhook_status (athlete_id, live_since, heartbeat)
+                SELECT DISTINCT athlete_id, ?, ? FROM sync_windows WHERE true
+                ON CONFLICT (athlete_id) DO UPDATE SET
+                    live_since = CASE WHEN heartbeat < excluded.heartbeat - ? THEN excluded.live_since ELSE live_since END,
+                    heartbeat = excluded.heartbeat
+            """, (now, now, WEBHOOK_MAX_AGE_SECONDS))
+
+    def set_webhook_live(self, live=True, now=None):
+        """Start (every athlete counts as live from now) or stop (no athlete does) applying webhook events."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM webhook_status")
+        if live:
+            self.webhook_heartbeat(now)
+
+    def resume_from(self, athlete_id, after_ts, before_ts):
+        """Start timestamp to re-request the window from: the whole window if never synced,
+        else SYNC_GRACE_SECONDS before the last sync, so rides uploaded late are picked up."""
+        synced = self.synced_until(athlete_id, after_ts, before_ts)
+        if synced is None:
+            return after_ts
+        return max(after_ts, synced - SYNC_GRACE_SECONDS)
+
+    def synced_until(self, athlete_id, after_ts, before_ts):
+        """When the window was last synced from the API, or None if never."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT synced_until FROM sync_windows WHERE athlete_id = ? AND after_ts = ? AND before_ts = ?",
+                (athlete_id, after_ts, before_ts),
+            ).fetchone()
+        return row[0] if row else None
+
+    def is_complete(self, athlete_id, after_ts, before_ts):
+        """True if the window was synced long enough after it ended to be final,
+        or synced while the webhook receiver was live (later changes arrive as events)."""
+        synced = self.synced_until(athlete_id, after_ts, before_ts)
+        if synced is None:
+            return False
+        if synced >= before_ts + SYNC_GRACE_SECONDS:
+            return True
+        live_since = self.webhook_live_since(athlete_id)
+        return live_since is not None and synced >= live_since
+
+    def mark_synced(self, athlete_id, after_ts, before_ts, synced_until=None):
+        if synced_until is None:
+            synced_until = int(time.time())
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_windows (athlete_id, after_ts, before_ts, synced_until) VALUES (?, ?, ?, ?)",
+                (athlete_id, after_ts, before_ts, synced_until),
+            )
@@ -0,0 +1,60 @@
+from collections import OrderedDict
+import threading
+from .instrumentation import instrumentation
+
+# Entries kept per cache; each analysis stage result counts as one entry
+DEFAULT_MAX_ENTRIES = 32
+
+
+def _freeze(value):
+    """Hashable form of lists/dicts/arrays used in cache keys (e.g. home/work coordinates)."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if hasattr(value, 'tolist'):
+        return _freeze(value.tolist())
+    return value
+
+
+class AnalysisCache:
+    """Bounded LRU cache of analysis stage results.
+
+    Each stage is looked up under (stage name, its own inputs), so a rerun only
+    recomputes the stages whose inputs changed; e.g. moving the radius slider
+    reruns detection but reuses the overview map.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, stage, key, compute):
+        """Cached result of compute() for (stage, key), computing and storing it on a miss."""
+        cache_key = (stage, _freeze(key))
+        with self._lock:
+            if cache_key in self._entries:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                instrumentation.count(f'cache.{stage}.hits')
+                return self._entries[cache_key]
+
+        value = compute()
+        with self._lock:
+            self.misses += 1
+            instrumentation.count(f'cache.{stage}.misses')
+            self._entries[cache_key] = value
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,176 @@
+import json
+import numpy as np
+from .location_analyzer import haversine_meters
+
+METERS_PER_DEGREE_LAT = 111320.0
+
+# Commutes run between these anchor categories, in either direction
+DEFAULT_COMMUTE_PAIRS = [('home', 'work')]
+
+
+class Anchor:
+    """A named place (home, an office, a station...) with its own detection radius."""
+
+    def __init__(self, name, category, lat, lng, radius_meters=300):
+        self.name = name
+        self.category = category
+        self.lat = float(lat)
+        self.lng = float(lng)
+        self.radius_meters = float(radius_meters)
+
+    @property
+    def latlng(self):
+        return (self.lat, self.lng)
+
+    def to_dict(self):
+        return {"name": self.name, "category": self.category, "lat": self.lat, "lng": self.lng,
+                "radius_meters": self.radius_meters}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["name"], data["category"], data["lat"], data["lng"], data.get("radius_meters", 300))
+
+    def __repr__(self):
+        return f"Anchor({self.name!r}, {self.category!r}, {self.lat:.5f}, {self.lng:.5f}, {self.radius_meters:g}m)"
+
+
+def home_work_anchors(home, work, radius_meters=300):
+    """The classic single Home and Work anchors."""
+    anchors = []
+    if home:
+        anchors.append(Anchor("Home", "home", home[0], home[1], radius_meters))
+    if work:
+        anchors.append(Anchor("Work", "work", work[0], work[1], radius_meters))
+    return anchors
+
+
+def load_anchors(path):
+    """Anchors and commute pairs from a JSON file: {"anchors": [...], "pairs": [["home", "work"], ...]}."""
+    with open(path, 'r') as f:
+        data = json.load(f)
+    anchors = [Anchor.from_dict(a) for a in data.get("anchors", [])]
+    pairs = [tuple(p) for p in data.get("pairs", DEFAULT_COMMUTE_PAIRS)]
+    return anchors, pairs
+
+
+def parse_anchor_lines(text, default_radius=300):
+    """Anchors from "name, category, lat, lng[, radius]" lines; returns (anchors, error messages)."""
+    anchors, errors = [], []
+    for number, line in enumerate(text.splitlines(), 1):
+        if not line.strip():
+            continue
+        parts = [p.strip() for p in line.split(',')]
+        try:
+            if len(parts) not in (4, 5):
+                raise ValueError("expected name, category, lat, lng[, radius]")
+            radius = float(parts[4]) if len(parts) == 5 else default_radius
+            anchors.append(Anchor(parts[0], parts[1].lower(), float(parts[2]), float(parts[3]), radius))
+        except ValueError as e:
+            errors.append(f"Line {number}: {e}")
+    return anchors, errors
+
+
+def parse_pairs(text):
+    """Commute category pairs from "home-work, home-station" style text."""
+    pairs = []
+    for item in text.split(','):
+        if '-' in item:
+            a, b = item.split('-', 1)
+            if a.strip() and b.strip():
+                pairs.append((a.strip().lower(), b.strip().lower()))
+    return pairs or list(DEFAULT_COMMUTE_PAIRS)
+
+
+class AnchorIndex:
+    """Grid index over anchors for bulk "which anchors is this point near" lookups.
+
+    Cells are as large as the biggest anchor radius, and each anchor is registered in
+    the 3x3 cells around its own, so a point only needs to be checked against the
+    anchors registered in its cell. Lookups are vectorized over (N, 2) coordinate
+    arrays, and their cost does not grow with the number of anchors.
+    """
+
+    def __init__(self, anchors):
+        self.anchors = list(anchors)
+        self.categories = sorted({a.category for a in self.anchors})
+        if len(self.categories) > 63:
+            raise ValueError("At most 63 anchor categories are supported")
+        category_index = {c: i for i, c in enumerate(self.categories)}
+
+        n = len(self.anchors)
+        self.coords = np.array([a.latlng for a in self.anchors], dtype=float).reshape(n, 2)
+        self.radii = np.array([a.radius_meters for a in self.anchors], dtype=float)
+        self.category_bits = np.array([1 << category_index[a.category] for a in self.anchors], dtype=np.int64)
+        if n == 0:
+            return
+
+        max_radius = self.radii.max()
+        self.cell_lat = max(max_radius, 1.0) / METERS_PER_DEGREE_LAT
+        # Longitude cells must span the widest radius in degrees, which grows towards the poles
+        max_abs_lat = min(np.abs(self.coords[:, 0]).max() + self.cell_lat, 89.0)
+        self.cell_lng = self.cell_lat / np.cos(np.radians(max_abs_lat))
+
+        lat_cells, lng_cells = self._cells(self.coords)
+        offsets = np.array([(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1)])
+        keys = self._key(lat_cells[:, None] + offsets[:, 0], lng_cells[:, None] + offsets[:, 1]).ravel()
+        members = np.repeat(np.arange(n), len(offsets))
+        order = np.argsort(keys, kind='stable')
+        self._keys = keys[order]
+        self._members = members[order]
+
+    def _cells(self, coords):
+        return (np.floor(coords[:, 0] / self.cell_lat).astype(np.int64),
+                np.floor(coords[:, 1] / self.cell_lng).astype(np.int64))
+
+    @staticmethod
+    def _key(lat_cell, lng_cell):
+        return lat_cell * (1 << 31) + lng_cell
+
+    def matches(self, coords):
+        """(point index, anchor index, meters) for every point lying within an anchor's radius."""
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        empty = np.empty(0, dtype=np.int64)
+        if not self.anchors or len(coords) == 0:
+            return empty, empty, np.empty(0)
+
+        valid = np.flatnonzero(~np.isnan(coords).any(axis=1))
+        lat_cells, lng_cells = self._cells(coords[valid])
+        keys = self._key(lat_cells, lng_cells)
+        lo = np.searchsorted(self._keys, keys, side='left')
+        hi = np.searchsorted(self._keys, keys, side='right')
+
+        # Expand each point into (point, candidate anchor) pairs
+        counts = hi - lo
+        points = np.repeat(valid, counts)
+        starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+        members = self._members[np.arange(len(points)) + starts]
+
+        meters = haversine_meters(coords[points, 0], coords[points, 1],
+                                  self.coords[members, 0], self.coords[members, 1])
+        within = meters <= self.radii[members]
+        return points[within], members[within], meters[within]
+
+    def category_masks(self, coords):
+        """Bit mask per point of the anchor categories (bit i = self.categories[i]) it lies within."""
+        n = len(np.asarray(coords).reshape(-1, 2))
+        masks = np.zeros(n, dtype=np.int64)
+        points, members, _ = self.matches(coords)
+        np.bitwise_or.at(masks, points, self.category_bits[members])
+        return masks
+
+    def nearest(self, coords):
+        """Index of the nearest anchor whose radius contains each point, else -1."""
+        n = len(np.asarray(coords).reshape(-1, 2))
+        result = np.full(n, -1, dtype=np.int64)
+        points, members, meters = self.matches(coords)
+        # Sort by point, then distance, and keep each point's first (closest) match
+        order = np.lexsort((meters, points))
+        points, members = points[order], members[order]
+        first = np.flatnonzero(np.r_[True, points[1:] != points[:-1]]) if len(points) else points
+        result[points[first]] = members[first]
+        return result
+
+    def pair_bits(self, pairs):
+        """(from bits, to bits) per commute pair whose categories are both present."""
+        index = {c: i for i, c in enumerate(self.categories)}
+        return [(1 << index[a], 1 << index[b]) for a, b in pairs if a in index and b in index]
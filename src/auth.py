@@ -1,24 +1,131 @@
 import os
+import json
+import threading
 import time
-import streamlit as st
-from stravalib.client import Client
 from dotenv import load_dotenv
+from .instrumentation import instrumentation
 
 load_dotenv()
 
 # Cloud-ready redirect URI
 DEFAULT_REDIRECT_URI = "https://stravaautomation.streamlit.app"
 
+# Tokens are refreshed this long before expires_at, so no request goes out with an expired token
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+# Keep-alive connections kept per host in each user's HTTP session (covers the fetch and edit workers)
+HTTP_POOL_SIZE = 8
+# Comma-separated athlete ids allowed to view and control the process-wide diagnostics
+OPERATOR_IDS_SETTING = "STRAVA_OPERATOR_IDS"
+
+
+class SessionTokenStore:
+    """Tokens in Streamlit session state (per browser session)."""
+
+    KEY = 'strava_tokens'
+
+    def load(self):
+        import streamlit as st
+        return st.session_state.get(self.KEY)
+
+    def save(self, tokens):
+        import streamlit as st
+        st.session_state[self.KEY] = tokens
+
+    def clear(self):
+        import streamlit as st
+        if self.KEY in st.session_state:
+            del st.session_state[self.KEY]
+
+
+class FileTokenStore:
+    """Tokens in a JSON file, for headless runs (CLI, cron)."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def save(self, tokens):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(tokens, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _http_session():
+    """requests Session with a keep-alive connection pool sized for concurrent API calls."""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def _setting(name, default=None, use_secrets=True):
+    """Read a setting from the environment, falling back to Streamlit secrets."""
+    value = os.getenv(name)
+    if value or not use_secrets:
+        return value or default
+    import streamlit as st
+    return st.secrets.get(name, default)
+
+
+def is_operator(athlete_id):
+    """Whether the athlete is one of the server's operators (STRAVA_OPERATOR_IDS)."""
+    if athlete_id is None:
+        return False
+    try:
+        ids = _setting(OPERATOR_IDS_SETTING) or ""
+    except FileNotFoundError:
+        # No secrets.toml, and the environment names no operators
+        ids = ""
+    return str(athlete_id) in {i.strip() for i in ids.split(',')}
+
 
 class StravaAuth:
-    """OAuth2 authentication for Strava with session-based token storage (multi-user support)."""
+    """OAuth2 authentication for Strava with pluggable token storage.
+
+    Defaults to per-user Streamlit session state (multi-user support); pass a
+    FileTokenStore to run without Streamlit. http_session replaces the pooled
+    requests Session the stravalib Client is built on (e.g. to reach a mock server).
+    """
     
-    def __init__(self):
+    def __init__(self, token_store=None, http_session=None):
+        # Streamlit secrets are only consulted when running inside the app
+        use_secrets = token_store is None
+        self.token_store = token_store or SessionTokenStore()
         # Load credentials from environment/secrets
-        self.client_id = os.getenv("STRAVA_CLIENT_ID") or st.secrets.get("STRAVA_CLIENT_ID")
-        self.client_secret = os.getenv("STRAVA_CLIENT_SECRET") or st.secrets.get("STRAVA_CLIENT_SECRET")
-        self.redirect_uri = os.getenv("STRAVA_REDIRECT_URI") or st.secrets.get("STRAVA_REDIRECT_URI", DEFAULT_REDIRECT_URI)
-        self.client = Client()
+        self.client_id = _setting("STRAVA_CLIENT_ID", use_secrets=use_secrets)
+        self.client_secret = _setting("STRAVA_CLIENT_SECRET", use_secrets=use_secrets)
+        self.redirect_uri = _setting("STRAVA_REDIRECT_URI", DEFAULT_REDIRECT_URI, use_secrets=use_secrets)
+        self.http_session = http_session
+        self._client = None
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def client(self):
+        """stravalib Client, created on first use so unauthenticated pages skip importing stravalib."""
+        if self._client is None:
+            from stravalib.client import Client
+
+            # One pooled session per user, reused for every request of the session
+            self._client = Client(requests_session=self.http_session or _http_session())
+            instrumentation.attach(self._client.protocol.rsession)
+        return self._client
 
     def is_configured(self):
         """Check if API credentials are configured."""
@@ -43,30 +150,30 @@ class StravaAuth:
         return token_response
 
     def _save_tokens_to_session(self, token_response):
-        """Store tokens in Streamlit session state (per-user)."""
-        st.session_state['strava_tokens'] = {
+        """Store tokens in the token store (session state by default, per-user)."""
+        self.token_store.save({
             'access_token': token_response['access_token'],
             'refresh_token': token_response['refresh_token'],
             'expires_at': token_response['expires_at']
-        }
+        })
 
     def _get_tokens_from_session(self):
-        """Retrieve tokens from session state."""
-        return st.session_state.get('strava_tokens')
+        """Retrieve tokens from the token store."""
+        return self.token_store.load()
 
     def clear_tokens(self):
         """Clear stored tokens (disconnect user)."""
-        if 'strava_tokens' in st.session_state:
-            del st.session_state['strava_tokens']
+        self.token_store.clear()
 
-    def get_client(self):
-        """Get an authenticated Strava client, refreshing tokens if needed."""
-        tokens = self._get_tokens_from_session()
-        if not tokens:
-            return None
+    def _needs_refresh(self, tokens):
+        return time.time() > tokens['expires_at'] - TOKEN_REFRESH_MARGIN_SECONDS
 
-        # Check if token is expired and refresh if needed
-        if time.time() > tokens['expires_at']:
+    def _refresh_tokens(self):
+        """Refresh the access token unless another thread just did; returns the current tokens or None."""
+        with self._refresh_lock:
+            tokens = self._get_tokens_from_session()
+            if not tokens or not self._needs_refresh(tokens):
+                return tokens
             try:
                 refresh_response = self.client.refresh_access_token(
                     client_id=self.client_id,
@@ -74,15 +181,37 @@ class StravaAuth:
                     refresh_token=tokens['refresh_token']
                 )
                 self._save_tokens_to_session(refresh_response)
-                tokens = refresh_response
+                return self._get_tokens_from_session()
             except Exception as e:
                 print(f"Error refreshing token: {e}")
                 self.clear_tokens()
                 return None
 
-        self.client.access_token = tokens['access_token']
-        return self.client
+    def get_client(self):
+        """Get the authenticated Strava client, refreshing tokens shortly before they expire."""
+        tokens = self._get_tokens_from_session()
+        if not tokens:
+            return None
+
+        if self._needs_refresh(tokens):
+            tokens = self._refresh_tokens()
+            if not tokens:
+                return None
+
+        client = self.client
+        if client.access_token != tokens['access_token']:
+            client.access_token = tokens['access_token']
+        return client
 
     def is_authenticated(self):
-        """Check if the user is currently authenticated."""
+        """Check if the user is currently authenticated.
+
+        Decided from the stored expiry time alone; the client is only touched when a
+        refresh is due.
+        """
+        tokens = self._get_tokens_from_session()
+        if not tokens:
+            return False
+        if not self._needs_refresh(tokens):
+            return True
         return self.get_client() is not None
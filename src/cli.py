@@ -0,0 +1,266 @@
+"""Headless commute analysis: fetch -> estimate locations -> detect commutes -> save logs.
+
+Usage:
+    python -m src.cli login [--code CODE]
+    python -m src.cli analyze --from 2024-01 [--to 2024-12] [--apply-edits] [--export]
+    python -m src.cli analyze --from 2024-01 --offline --athlete-id 12345
+    python -m src.cli webhook serve [--port 8080]
+    python -m src.cli webhook send --aspect create --object-id 123 --owner-id 12345
+    python -m src.cli logs claim --athlete-id 12345 [--month 2023-05 ...]
+
+Runs without Streamlit, folium or plotly so it can be scheduled from cron. Tokens are
+read from (and refreshed into) a JSON token file; --offline reads rides from the
+local activity store only and makes no API calls.
+"""
+import argparse
+import datetime
+import functools
+import json
+import os
+import sys
+
+from .activity_store import ActivityStore, STORE_PATH
+from .anchors import load_anchors
+from .export import EXPORT_DIR, export_parquet
+from .auth import FileTokenStore, StravaAuth
+from .location_model import rebuild_locations, update_locations
+from .log_manager import LogManager
+from .pipeline import DEFAULT_MAX_GAP_HOURS, DEFAULT_RADIUS_METERS, analyze, flatten_commutes, month_logs
+from .route_index import athlete_route_index
+from .strava_client import StravaClient, edge_windows, month_bounds
+from .webhook import (ASPECT_TYPES, DEFAULT_PORT, OBJECT_TYPES, WebhookProcessor, WebhookServer,
+                      fetch_with_token_files, send_event, send_handshake)
+
+DEFAULT_TOKEN_FILE = "data/tokens.json"
+
+
+def _month(value):
+    try:
+        parsed = datetime.datetime.strptime(value, "%Y-%m")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM, got {value!r}")
+    return parsed.year, parsed.month
+
+
+def cmd_login(args):
+    strava = StravaClient(token_store=FileTokenStore(args.token_file))
+    if not strava.auth.is_configured():
+        print("STRAVA_CLIENT_ID and STRAVA_CLIENT_SECRET must be set (environment or .env).", file=sys.stderr)
+        return 2
+    if not args.code:
+        print("Open this URL, authorize the app, then rerun with --code set to the 'code' query parameter:")
+        print(strava.auth.get_auth_url())
+        return 0
+    strava.auth.exchange_code(args.code)
+    print(f"Tokens saved to {args.token_file}")
+    return 0
+
+
+def cmd_analyze(args):
+    start = args.start
+    end = args.end or start
+    after, _ = month_bounds(*start)
+    _, before = month_bounds(*end)
+    if after >= before:
+        print("--to must not be before --from", file=sys.stderr)
+        return 2
+
+    anchors, pairs = load_anchors(args.anchors) if args.anchors else (None, None)
+
+    store = ActivityStore(args.store)
+    if args.offline:
+        if args.athlete_id is None:
+            print("--offline requires --athlete-id", file=sys.stderr)
+            return 2
+        strava = None
+        rides = store.get_activities(args.athlete_id, int(after.timestamp()), int(before.timestamp()), activity_type='Ride')
+        edge_rides = [r for start, end in edge_windows(after, before)
+                      for r in store.get_activities(args.athlete_id, start.timestamp(), end.timestamp(), activity_type='Ride')]
+    else:
+        strava = StravaClient(store=store, token_store=FileTokenStore(args.token_file))
+        if not strava.is_authenticated():
+            print(f"Not authenticated: run 'python -m src.cli login' to create {args.token_file}", file=sys.stderr)
+            return 2
+        rides = strava.fetch_rides_range(after, before)
+        edge_rides = strava.fetch_edge_rides(after, before)
+
+    print(f"{len(rides)} rides between {after:%Y-%m} and {end[0]}-{end[1]:02d}")
+    if not rides:
+        return 0
+
+    # Home/work come from the athlete's saved location model, updated with these rides only
+    athlete_id = args.athlete_id if args.offline else strava.get_athlete_id()
+    home = work = None
+    if athlete_id is not None:
+        if args.recluster:
+            history = store.get_activities(athlete_id, 0, float('inf'), activity_type='Ride')
+            print(f"Re-clustering home/work over {len(history)} stored rides")
+            home, work = rebuild_locations(athlete_id, history)
+        else:
+            home, work = update_locations(athlete_id, rides)
+
+    # Usual routes come from every stored ride of the athlete, not only this window's
+    route_index = None
+    if args.exclude_detours and athlete_id is not None:
+        route_index = athlete_route_index(athlete_id, store, rides)
+
+    result = analyze(rides, radius_meters=args.radius, max_time_gap_hours=args.max_gap, home=home, work=work,
+                      edge_rides=edge_rides, anchors=anchors, commute_pairs=pairs,
+                      exclude_detours=args.exclude_detours, route_index=route_index)
+    home, work, commutes = result['home'], result['work'], result['commutes']
+    if not (home and work):
+        print("Could not estimate both home and work locations; no commutes detected.", file=sys.stderr)
+        return 1
+    print(f"Home: {home[0]:.5f}, {home[1]:.5f}  Work: {work[0]:.5f}, {work[1]:.5f}")
+    print(f"{len(commutes)} commutes ({len(flatten_commutes(commutes))} activities)")
+    if args.exclude_detours:
+        print(f"{len(result['detours'])} detours off the usual routes excluded")
+
+    logs = month_logs(rides, commutes, home, work)
+    lm = LogManager(athlete_id)
+    failed = 0
+    for (year, month), log_data in logs.items():
+        stats = log_data['statistics']
+        print(f"  {year}-{month:02d}: {log_data['commutes_count']} commutes, "
+              f"{stats['total_distance_km']:.1f} km of {stats['total_rides']} rides")
+        if args.dry_run:
+            continue
+        lm.upsert_log(year, month, log_data)
+
+        if args.apply_edits and log_data['commute_activity_ids']:
+            update_params = strava.build_update_params(commute=True)
+            scheduler = strava.create_edit_scheduler(f"{year}-{month:02d}", update_params)
+            summary = scheduler.run(log_data['commute_activity_ids'], update_params)
+            failed += summary['failed']
+            print(f"    edits: {summary['success']} updated, {summary['skipped']} already done, {summary['failed']} failed")
+
+    if args.dry_run:
+        print("Dry run: no logs written.")
+    elif args.export:
+        partitions = export_parquet(rides, commutes, result['anchors'], athlete_id, result['detours'], root=args.export)
+        print(f"Exported {len(rides)} rides to {args.export} ({len(partitions)} month partitions)")
+    return 1 if failed else 0
+
+
+def cmd_logs_claim(args):
+    lm = LogManager(args.athlete_id)
+    if not lm.unassigned_count():
+        print("No unassigned logs to claim.")
+        return 0
+    moved = lm.claim_unassigned(args.months)
+    print(f"Moved {moved} unassigned logs to athlete {args.athlete_id}; {lm.unassigned_count()} remain unassigned")
+    return 0
+
+
+def cmd_webhook_serve(args):
+    processor = WebhookProcessor(
+        store=ActivityStore(args.store),
+        fetch_activity=functools.partial(fetch_with_token_files, fallback_token_file=args.token_file),
+    )
+    if not processor.verify_token:
+        print("STRAVA_WEBHOOK_VERIFY_TOKEN must be set (environment or .env).", file=sys.stderr)
+        return 2
+    server = WebhookServer(processor, host=args.host, port=args.port)
+    print(f"Receiving Strava webhook events on http://{args.host}:{server.port}/ (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def cmd_webhook_subscribe(args):
+    auth = StravaAuth(token_store=FileTokenStore(args.token_file))
+    verify_token = os.getenv("STRAVA_WEBHOOK_VERIFY_TOKEN")
+    if not (auth.is_configured() and verify_token):
+        print("STRAVA_CLIENT_ID, STRAVA_CLIENT_SECRET and STRAVA_WEBHOOK_VERIFY_TOKEN must be set.", file=sys.stderr)
+        return 2
+    subscription = auth.client.create_subscription(
+        client_id=auth.client_id, client_secret=auth.client_secret,
+        callback_url=args.callback_url, verify_token=verify_token,
+    )
+    print(f"Subscription {subscription.id} created for {args.callback_url}")
+    return 0
+
+
+def cmd_webhook_send(args):
+    try:
+        if args.handshake:
+            status, body = send_handshake(args.url, os.getenv("STRAVA_WEBHOOK_VERIFY_TOKEN", ""))
+        else:
+            updates = {'title': args.title} if args.title else {}
+            status, body = send_event(args.url, args.aspect, args.object_id, args.owner_id,
+                                      object_type=args.object_type, updates=updates)
+    except OSError as e:
+        print(f"Could not reach {args.url}: {e}", file=sys.stderr)
+        return 1
+    print(status, json.dumps(body))
+    return 0 if status == 200 else 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m src.cli", description=__doc__.splitlines()[0])
+    parser.add_argument('--token-file', default=DEFAULT_TOKEN_FILE, help="JSON file holding OAuth tokens")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    login = subparsers.add_parser('login', help="Authorize with Strava and save tokens")
+    login.add_argument('--code', help="Authorization code from the redirect URL")
+    login.set_defaults(func=cmd_login)
+
+    run = subparsers.add_parser('analyze', help="Analyze a month range and save logs")
+    run.add_argument('--from', dest='start', type=_month, required=True, help="First month (YYYY-MM)")
+    run.add_argument('--to', dest='end', type=_month, help="Last month (YYYY-MM), defaults to --from")
+    run.add_argument('--radius', type=int, default=DEFAULT_RADIUS_METERS, help="Detection radius in meters")
+    run.add_argument('--max-gap', type=float, default=DEFAULT_MAX_GAP_HOURS, help="Max stop duration in hours")
+    run.add_argument('--anchors', help="JSON file of extra anchors and commute category pairs")
+    run.add_argument('--exclude-detours', action='store_true', help="Drop commutes that are off the usual routes")
+    run.add_argument('--store', default=STORE_PATH, help="Local activity store path")
+    run.add_argument('--offline', action='store_true', help="Read rides from the local store only")
+    run.add_argument('--athlete-id', type=int, help="Athlete id for --offline")
+    run.add_argument('--recluster', action='store_true', help="Rebuild the home/work model from all stored rides")
+    run.add_argument('--dry-run', action='store_true', help="Print results without writing logs")
+    run.add_argument('--apply-edits', action='store_true', help="Mark detected commutes on Strava")
+    run.add_argument('--export', nargs='?', const=EXPORT_DIR, metavar='DIR',
+                     help=f"Also write every analysed ride to partitioned Parquet (default {EXPORT_DIR})")
+    run.set_defaults(func=cmd_analyze)
+
+    logs = subparsers.add_parser('logs', help="Manage saved analysis logs")
+    logs_commands = logs.add_subparsers(dest='logs_command', required=True)
+    claim = logs_commands.add_parser(
+        'claim', help="Assign logs saved before per-athlete storage to an athlete (the app only offers verified ones)")
+    claim.add_argument('--athlete-id', type=int, required=True)
+    claim.add_argument('--month', dest='months', type=_month, action='append', help="Only this month (repeatable)")
+    claim.set_defaults(func=cmd_logs_claim)
+
+    webhook = subparsers.add_parser('webhook', help="Receive Strava push events into the activity store")
+    webhook_commands = webhook.add_subparsers(dest='webhook_command', required=True)
+    serve = webhook_commands.add_parser('serve', help="Run the webhook receiver")
+    serve.add_argument('--host', default="0.0.0.0")
+    serve.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve.add_argument('--store', default=STORE_PATH, help="Local activity store path")
+    serve.set_defaults(func=cmd_webhook_serve)
+    subscribe = webhook_commands.add_parser('subscribe', help="Register the receiver's public URL with Strava")
+    subscribe.add_argument('--callback-url', required=True)
+    subscribe.set_defaults(func=cmd_webhook_subscribe)
+    send = webhook_commands.add_parser('send', help="Send a test event (or handshake) to a local receiver")
+    send.add_argument('--url', default=f"http://localhost:{DEFAULT_PORT}/")
+    send.add_argument('--handshake', action='store_true', help="Send the subscription validation request instead")
+    send.add_argument('--aspect', choices=ASPECT_TYPES, default='create')
+    send.add_argument('--object-type', choices=OBJECT_TYPES, default='activity')
+    send.add_argument('--object-id', type=int, default=0)
+    send.add_argument('--owner-id', type=int, default=0)
+    send.add_argument('--title', help="New title for an update event")
+    send.set_defaults(func=cmd_webhook_send)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if getattr(args, 'apply_edits', False) and getattr(args, 'offline', False):
+        print("--apply-edits needs API access and cannot be combined with --offline", file=sys.stderr)
+        return 2
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,34 +1,56 @@
-from .location_analyzer import LocationAnalyzer
+import numpy as np
+from .location_analyzer import LocationAnalyzer, haversine_meters
+from .rides import RideTable
+from .anchors import DEFAULT_COMMUTE_PAIRS, AnchorIndex, home_work_anchors
+from .instrumentation import instrumentation
 
 class CommuteDetector:
-    def __init__(self, home, work, radius_meters=300, max_time_gap_hours=2):
+    """Finds commutes: rides, or chains of rides, between anchors of paired categories.
+
+    home and work become the 'home' and 'work' anchors with radius_meters; extra
+    anchors (each with its own radius) can be added, and commute_pairs lists the
+    category pairs that count as a commute in either direction.
+    """
+
+    def __init__(self, home, work, radius_meters=300, max_time_gap_hours=2, anchors=None, commute_pairs=None):
         self.home = home
         self.work = work
         self.radius_meters = radius_meters
         self.max_time_gap_hours = max_time_gap_hours
         self.analyzer = LocationAnalyzer()
+        self.anchors = home_work_anchors(home, work, radius_meters) + list(anchors or [])
+        self.commute_pairs = list(commute_pairs or DEFAULT_COMMUTE_PAIRS)
+        self.index = AnchorIndex(self.anchors)
+        self._pair_bits = self.index.pair_bits(self.commute_pairs)
 
     def is_commute(self, activity):
         if not activity.start_latlng or not activity.end_latlng:
             return False
+        return bool(self.classify_batch([activity.start_latlng], [activity.end_latlng])[0])
 
-        starts_at_home = self.analyzer.is_near(activity.start_latlng, self.home, self.radius_meters)
-        ends_at_work = self.analyzer.is_near(activity.end_latlng, self.work, self.radius_meters)
-        
-        starts_at_work = self.analyzer.is_near(activity.start_latlng, self.work, self.radius_meters)
-        ends_at_home = self.analyzer.is_near(activity.end_latlng, self.home, self.radius_meters)
+    def classify_batch(self, start_coords, end_coords):
+        """Vectorized is_commute over (N, 2) start/end coordinate arrays (NaN = missing).
 
-        return (starts_at_home and ends_at_work) or (starts_at_work and ends_at_home)
+        Each point is looked up in the anchor index once, so the cost per ride does not
+        depend on the number of anchors. Distances use the haversine formula.
+        """
+        start_masks = self.index.category_masks(start_coords)
+        end_masks = self.index.category_masks(end_coords)
 
+        result = np.zeros(len(start_masks), dtype=bool)
+        for a, b in self._pair_bits:
+            starts_at_a, ends_at_b = (start_masks & a) != 0, (end_masks & b) != 0
+            starts_at_b, ends_at_a = (start_masks & b) != 0, (end_masks & a) != 0
+            result |= (starts_at_a & ends_at_b) | (starts_at_b & ends_at_a)
+        return result
+
+    @instrumentation.timed('detection')
     def detect_commutes(self, activities):
-        commutes = []
-        regular_rides = []
-        
-        for activity in activities:
-            if self.is_commute(activity):
-                commutes.append(activity)
-            else:
-                regular_rides.append(activity)
+        table = RideTable.of(activities)
+        is_commute = self.classify_batch(table.start_coords, table.end_coords)
+
+        commutes = table.take(is_commute)
+        regular_rides = table.take(~is_commute)
 
         # Chained activity detection (Bonus)
         chained_commutes, remaining_rides = self.detect_chained_commutes(regular_rides, self.max_time_gap_hours)
@@ -36,73 +58,43 @@ class CommuteDetector:
         
         return commutes
 
+    @instrumentation.timed('detection.chains')
     def detect_chained_commutes(self, rides, max_time_gap_hours=None):
+        """Group consecutive rides into chains and keep those going Home -> Work or Work -> Home.
+
+        Consecutive rides (by start time) link when the next one starts less than
+        max_time_gap_hours after the previous one ended and within radius of where it
+        ended. Links are computed for all neighbour pairs at once. Returns
+        (chained_groups, remaining) where remaining keeps the input order.
+        """
         if max_time_gap_hours is None:
             max_time_gap_hours = self.max_time_gap_hours
+        table = RideTable.of(rides)
+        if len(table) < 2:
+            return [], list(table)
+
         # Sort rides by start time
-        sorted_rides = sorted(rides, key=lambda r: r.start_date)
-        
-        chained_groups = []
-        current_chain = []
-        
-        for ride in sorted_rides:
-            if not current_chain:
-                current_chain.append(ride)
-                continue
-            
-            last_ride = current_chain[-1]
-            # Strava activities don't always have end_date, so we calculate it
-            # elapsed_time might be a stravalib Duration object, timedelta, or float
-            from datetime import timedelta
-            def get_seconds(obj):
-                if hasattr(obj, 'total_seconds') and callable(obj.total_seconds):
-                    return float(obj.total_seconds())
-                try:
-                    return float(obj)
-                except:
-                    # Some versions might have a 'seconds' attribute
-                    return float(getattr(obj, 'seconds', 0))
-
-            elapsed = timedelta(seconds=get_seconds(last_ride.elapsed_time))
-            last_end_date = last_ride.start_date + elapsed
-            
-            time_gap = (ride.start_date - last_end_date).total_seconds() / 3600.0
-            
-            # Check if geographically and temporally chained
-            is_same_spot = self.analyzer.is_near(last_ride.end_latlng, ride.start_latlng, self.radius_meters)
-            
-            if time_gap < max_time_gap_hours and is_same_spot:
-                current_chain.append(ride)
-            else:
-                # Check if the finished chain matches Home -> Work or Work -> Home
-                if len(current_chain) > 1:
-                    if self.is_chain_commute(current_chain):
-                        chained_groups.append(current_chain)
-                
-                current_chain = [ride]
-        
-        # Check last chain
-        if len(current_chain) > 1 and self.is_chain_commute(current_chain):
-            chained_groups.append(current_chain)
+        order = np.argsort(table.start_ts, kind='stable')
+        start_coords = table.start_coords[order]
+        end_coords = table.end_coords[order]
 
-        # Flatten chained groups into single "virtual" commute objects or just mark them
-        # For simplicity, we'll return them as a list of lists of activities
-        # And we need to filter out the rides that are now part of a chain from the "remaining"
-        
-        used_ids = {r.id for group in chained_groups for r in group}
-        remaining = [r for r in rides if r.id not in used_ids]
-        
-        # Instead of returning list of lists, let's treat each group as a set of activities
-        return chained_groups, remaining
+        # Strava activities don't always have end_date, so it comes from start + elapsed
+        time_gap = (table.start_ts[order][1:] - table.end_ts[order][:-1]) / 3600.0
+        gap_meters = haversine_meters(end_coords[:-1, 0], end_coords[:-1, 1], start_coords[1:, 0], start_coords[1:, 1])
+        linked = (time_gap < max_time_gap_hours) & (np.nan_to_num(gap_meters, nan=np.inf) <= self.radius_meters)
 
-    def is_chain_commute(self, chain):
-        first = chain[0]
-        last = chain[-1]
-        
-        starts_at_home = self.analyzer.is_near(first.start_latlng, self.home, self.radius_meters)
-        ends_at_work = self.analyzer.is_near(last.end_latlng, self.work, self.radius_meters)
-        
-        starts_at_work = self.analyzer.is_near(first.start_latlng, self.work, self.radius_meters)
-        ends_at_home = self.analyzer.is_near(last.end_latlng, self.home, self.radius_meters)
-        
-        return (starts_at_home and ends_at_work) or (starts_at_work and ends_at_home)
+        # A chain runs between breaks; only chains of two or more rides matter
+        chain_ids = np.concatenate(([0], np.cumsum(~linked)))
+        firsts = np.flatnonzero(np.r_[True, ~linked])
+        lasts = np.r_[firsts[1:] - 1, len(order) - 1]
+        multi = lasts > firsts
+        firsts, lasts = firsts[multi], lasts[multi]
+
+        # Check if each chain matches Home -> Work or Work -> Home
+        is_commute = self.classify_batch(start_coords[firsts], end_coords[lasts])
+        chained_groups = [table.take(order[f:l + 1]) for f, l in zip(firsts[is_commute], lasts[is_commute])]
+
+        in_chain = np.zeros(len(table), dtype=bool)
+        in_chain[order] = np.isin(chain_ids, chain_ids[firsts[is_commute]])
+        remaining = table.take(~in_chain)
+        return chained_groups, remaining
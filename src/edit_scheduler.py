@@ -0,0 +1,255 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+JOURNAL_DIR = "data/journal"
+
+# Strava's default app limits, shared by reads and writes: 100 requests per 15 minutes, 1000 per day
+WRITE_LIMITS = [(100, 15 * 60), (1000, 24 * 3600)]
+# Share of each limit the app uses; the rest is left for other clients of the app
+WRITE_HEADROOM = 0.9
+# How often a running batch re-resolves its client, refreshing the access token before it expires
+CLIENT_REFRESH_SECONDS = 30
+
+
+class WindowCounter:
+    """Requests sent in the current fixed window of `period` seconds.
+
+    Windows are aligned to the epoch, like Strava's (quarter hours and UTC days), so
+    no window can see more than `limit` requests, however the run is timed.
+    """
+
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self.window = None
+        self.used = 0
+
+    def _roll(self, now):
+        window = int(now // self.period)
+        if window != self.window:
+            self.window, self.used = window, 0
+
+    def wait_time(self, now):
+        """Seconds until one more request fits in the window."""
+        self._roll(now)
+        return 0.0 if self.used < self.limit else (self.window + 1) * self.period - now
+
+
+class RateLimiter:
+    """Thread-safe limiter that blocks until every window has room, then counts one request in each.
+
+    observe() folds in the usage Strava reports in X-RateLimit-Usage, which also counts
+    requests made by other schedulers, pages and processes of the same app.
+    """
+
+    def __init__(self, limits=WRITE_LIMITS, headroom=WRITE_HEADROOM):
+        self.headroom = headroom
+        self.windows = [WindowCounter(max(1, int(limit * headroom)), period) for limit, period in limits]
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                wait = max(window.wait_time(now) for window in self.windows)
+                if wait <= 0:
+                    for window in self.windows:
+                        window.used += 1
+                    return
+            time.sleep(wait)
+
+    def penalize(self):
+        """Close the short-term window after the server reported a 429."""
+        with self._lock:
+            self.windows[0].wait_time(time.time())
+            self.windows[0].used = self.windows[0].limit
+
+    def observe(self, headers):
+        """Count the server-reported usage (X-RateLimit-Usage / -Limit: "15 min,daily") against each window."""
+        try:
+            usage = [int(v) for v in headers['X-RateLimit-Usage'].split(',')]
+            limits = [int(v) for v in headers['X-RateLimit-Limit'].split(',')]
+        except (KeyError, ValueError):
+            return
+        with self._lock:
+            now = time.time()
+            for window, used, limit in zip(self.windows, usage, limits):
+                window.wait_time(now)
+                # Requests left on the server, less our headroom, bound what this window may still send
+                remaining = int(limit * self.headroom) - used
+                window.used = max(window.used, window.limit - remaining)
+
+    def attach(self, session):
+        """Observe every response of a requests.Session (idempotent)."""
+        hooks = session.hooks.setdefault('response', [])
+        if self._record_response not in hooks:
+            hooks.append(self._record_response)
+
+    def _record_response(self, response, *args, **kwargs):
+        self.observe(response.headers)
+
+
+_shared_limiter = None
+_shared_lock = threading.Lock()
+
+
+def shared_rate_limiter():
+    """The process-wide limiter: Strava's limits apply to the whole app, not to one batch or fetch."""
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = RateLimiter()
+        return _shared_limiter
+
+
+class EditJournal:
+    """Append-only JSON-lines record of edit outcomes, used to resume interrupted batches."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def completed(self):
+        """Ids of activities already updated successfully."""
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Partially written last line of an interrupted run
+                if entry.get('status') == 'done':
+                    done.add(entry['id'])
+        return done
+
+    def record(self, activity_id, status, error=None):
+        entry = {'id': activity_id, 'status': status, 'time': time.time()}
+        if error:
+            entry['error'] = error
+        with self._lock, open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def journal_path(name, update_params):
+    """Journal file for a named batch (e.g. a log month) and a specific set of edits."""
+    digest = hashlib.sha1(json.dumps(update_params, sort_keys=True).encode()).hexdigest()[:8]
+    return os.path.join(JOURNAL_DIR, f"{name}-{digest}.jsonl")
+
+
+def _status_code(error):
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+def _is_retryable(error):
+    from stravalib.exc import RateLimitExceeded
+
+    if isinstance(error, RateLimitExceeded):
+        return True
+    status = _status_code(error)
+    # A 401 means the token expired mid-batch; the next attempt uses the refreshed one
+    return status is not None and (status in (401, 429) or status >= 500)
+
+
+def call_with_retries(call, rate_limiter, max_retries=5, backoff_seconds=2.0):
+    """call() once the rate limiter allows, retried with exponential backoff on 401/429/5xx.
+
+    Returns its result, or re-raises the last error once retries run out or it is not retryable.
+    """
+    from stravalib.exc import RateLimitExceeded
+
+    for attempt in range(max_retries + 1):
+        rate_limiter.acquire()
+        try:
+            return call()
+        except Exception as e:
+            if attempt == max_retries or not _is_retryable(e):
+                raise
+            delay = backoff_seconds * (2 ** attempt) * (1 + random.random())
+            if isinstance(e, RateLimitExceeded) or _status_code(e) == 429:
+                rate_limiter.penalize()
+                delay = max(delay, getattr(e, 'timeout', None) or 0)
+            time.sleep(delay)
+
+
+class EditScheduler:
+    """Applies activity updates on a small worker pool within Strava's write limits.
+
+    Rate-limit (429), expired-token (401) and server (5xx) errors are retried with
+    exponential backoff; every outcome is journaled so a rerun skips activities that
+    were already updated. With get_client (e.g. StravaAuth.get_client) the client is
+    re-resolved from the calling thread every CLIENT_REFRESH_SECONDS, so a batch slowed
+    down by the rate limiter keeps a valid access token. Workers cannot do this
+    themselves: Streamlit session state is only readable from the script thread.
+    """
+
+    def __init__(self, client, journal, rate_limiter=None, max_workers=4, max_retries=5, backoff_seconds=2.0,
+                 get_client=None):
+        self.client = client
+        self.get_client = get_client
+        self.journal = journal
+        self.rate_limiter = rate_limiter or shared_rate_limiter()
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+
+    def _update(self, activity_id, update_params):
+        try:
+            # self.client is looked up on every attempt, so a retry uses a refreshed token
+            call_with_retries(lambda: self.client.update_activity(activity_id, **update_params),
+                              self.rate_limiter, self.max_retries, self.backoff_seconds)
+        except Exception as e:
+            print(f"Error updating activity {activity_id}: {e}")
+            self.journal.record(activity_id, 'failed', str(e))
+            return False
+        self.journal.record(activity_id, 'done')
+        return True
+
+    def _refresh_client(self):
+        client = self.get_client() if self.get_client else None
+        if client is not None:
+            self.client = client
+
+    def run(self, activity_ids, update_params, progress_callback=None):
+        """Update all activities not yet in the journal.
+
+        progress_callback(done, total) is called from the calling thread after each result.
+        Returns a dict with 'success', 'failed', 'skipped' (already done in the journal)
+        and 'duplicates' (repeated ids in activity_ids, updated once) counts.
+        """
+        unique_ids = list(dict.fromkeys(activity_ids))
+        completed = self.journal.completed()
+        pending = [aid for aid in unique_ids if aid not in completed]
+        total = len(pending)
+        summary = {'success': 0, 'failed': 0, 'skipped': len(unique_ids) - total,
+                   'duplicates': len(activity_ids) - len(unique_ids)}
+
+        if not pending:
+            if progress_callback:
+                progress_callback(0, 0)
+            return summary
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            running = {pool.submit(self._update, aid, update_params) for aid in pending}
+            done = 0
+            while running:
+                self._refresh_client()
+                finished, running = wait(running, timeout=CLIENT_REFRESH_SECONDS, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done += 1
+                    summary['success' if future.result() else 'failed'] += 1
+                    if progress_callback:
+                        progress_callback(done, total)
+        return summary
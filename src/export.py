@@ -0,0 +1,155 @@
+"""Columnar export of analysed rides for analytics jobs and notebooks.
+
+Every analysed ride becomes one typed row in a Parquet dataset, hive-partitioned so
+readers can prune by athlete, year and month:
+
+    data/export/athlete_id=42/year=2024/month=3/part-0.parquet
+
+Re-exporting a month replaces that month's partition. pyarrow is imported on first use.
+"""
+import numpy as np
+from .log_manager import UNASSIGNED_ATHLETE_ID
+from .rides import RideTable
+
+EXPORT_DIR = "data/export"
+
+
+def _schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ('id', pa.int64()),
+        ('start_time', pa.timestamp('us', tz='UTC')),
+        ('end_time', pa.timestamp('us', tz='UTC')),
+        ('elapsed_seconds', pa.float64()),
+        ('distance_m', pa.float64()),
+        ('start_lat', pa.float64()),
+        ('start_lng', pa.float64()),
+        ('end_lat', pa.float64()),
+        ('end_lng', pa.float64()),
+        ('commute', pa.bool_()),
+        ('commute_type', pa.dictionary(pa.int8(), pa.string())),
+        ('chain_id', pa.int64()),
+        ('detour', pa.bool_()),
+        ('start_anchor', pa.dictionary(pa.int32(), pa.string())),
+        ('end_anchor', pa.dictionary(pa.int32(), pa.string())),
+        ('athlete_id', pa.int64()),
+        ('year', pa.int16()),
+        ('month', pa.int8()),
+    ])
+
+
+def _partitioning():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    return ds.partitioning(pa.schema([('athlete_id', pa.int64()), ('year', pa.int16()), ('month', pa.int8())]),
+                           flavor='hive')
+
+
+def ride_labels(rides, commutes, detours=()):
+    """Per-ride (commute, commute_type, chain_id, detour) arrays aligned with a RideTable.
+
+    A chain's id is the id of its first ride (-1 outside chains, null in the export);
+    commute_type is 'simple', 'chained' or None.
+    """
+    table = RideTable.of(rides)
+    position = {ride_id: i for i, ride_id in enumerate(table.ids.tolist())}
+    n = len(table)
+    commute = np.zeros(n, dtype=bool)
+    commute_type = np.full(n, None, dtype=object)
+    chain_id = np.full(n, -1, dtype=np.int64)
+    for c in commutes:
+        chain = c if isinstance(c, list) else [c]
+        for ride in chain:
+            i = position.get(ride.id)
+            if i is None:
+                continue  # Edge ride from outside the window
+            commute[i] = True
+            commute_type[i] = 'chained' if isinstance(c, list) else 'simple'
+            if isinstance(c, list):
+                chain_id[i] = chain[0].id
+    detour = np.isin(table.ids, np.array([r.id for r in detours], dtype=np.int64))
+    return commute, commute_type, chain_id, detour
+
+
+def export_table(rides, commutes, anchors=(), athlete_id=None, detours=()):
+    """pyarrow Table with one typed row per ride, ordered by start time.
+
+    anchors is the full anchor list the commutes were detected with (see analyze());
+    start_anchor/end_anchor name the nearest anchor containing each end of the ride.
+    """
+    import pyarrow as pa
+    from .anchors import AnchorIndex
+
+    table = RideTable.of(rides)
+    order = np.argsort(table.start_ts, kind='stable')
+    commute, commute_type, chain_id, detour = ride_labels(table, commutes, detours)
+
+    anchors = list(anchors)
+    names = np.array([a.name for a in anchors] + [None], dtype=object)
+    index = AnchorIndex(anchors)
+    start_anchor = names[index.nearest(table.start_coords)]
+    end_anchor = names[index.nearest(table.end_coords)]
+
+    start_us = np.round(table.start_ts * 1e6).astype(np.int64)
+    end_us = np.round(table.end_ts * 1e6).astype(np.int64)
+    months = start_us.astype('datetime64[us]').astype('datetime64[M]').astype(np.int64)
+    athlete = UNASSIGNED_ATHLETE_ID if athlete_id is None else athlete_id
+
+    schema = _schema()
+    columns = {
+        'id': table.ids,
+        'start_time': start_us,
+        'end_time': end_us,
+        'elapsed_seconds': table.elapsed,
+        'distance_m': table.distance,
+        'start_lat': table.start_coords[:, 0],
+        'start_lng': table.start_coords[:, 1],
+        'end_lat': table.end_coords[:, 0],
+        'end_lng': table.end_coords[:, 1],
+        'commute': commute,
+        'commute_type': commute_type,
+        'chain_id': np.where(chain_id == -1, None, chain_id).astype(object),
+        'detour': detour,
+        'start_anchor': start_anchor,
+        'end_anchor': end_anchor,
+        'athlete_id': np.full(len(table), athlete, dtype=np.int64),
+        'year': (1970 + months // 12).astype(np.int16),
+        'month': (months % 12 + 1).astype(np.int8),
+    }
+    arrays = []
+    for field in schema:
+        values = columns[field.name][order]
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, type=pa.string()).dictionary_encode().cast(field.type))
+        else:
+            # from_pandas turns NaN coordinates into nulls
+            arrays.append(pa.array(values, type=field.type, from_pandas=True))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def export_parquet(rides, commutes, anchors=(), athlete_id=None, detours=(), root=EXPORT_DIR):
+    """Write analysed rides to the partitioned Parquet dataset; returns the (year, month) partitions written."""
+    import pyarrow.dataset as ds
+
+    table = export_table(rides, commutes, anchors, athlete_id, detours)
+    if table.num_rows == 0:
+        return []
+    ds.write_dataset(table, root, format='parquet', partitioning=_partitioning(),
+                     existing_data_behavior='delete_matching', basename_template='part-{i}.parquet')
+    return sorted(set(zip(table['year'].to_pylist(), table['month'].to_pylist())))
+
+
+def read_export(root=EXPORT_DIR, columns=None, filter=None):
+    """Scan the export as a pandas DataFrame, reading only the given columns and matching partitions.
+
+    filter is a pyarrow.dataset expression, e.g. (ds.field('year') >= 2023) & ds.field('commute').
+    """
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(root, format='parquet', partitioning=_partitioning())
+    df = dataset.to_table(columns=columns, filter=filter).to_pandas()
+    if 'chain_id' in df:
+        df['chain_id'] = df['chain_id'].astype('Int64')  # Keep ids integral next to the nulls
+    return df
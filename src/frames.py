@@ -0,0 +1,77 @@
+"""Typed pandas frames of detected commutes, and their period rollups for the charts.
+
+pandas is imported on first use, so importing this module stays cheap.
+"""
+import numpy as np
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+COMMUTE_TYPES = ['Simple', 'Chained']
+# Chart one bar per week up to this many weeks, then per month up to this many months, else per year
+MAX_WEEKLY_BARS = 60
+MAX_MONTHLY_BARS = 60
+
+
+def commute_frame(commutes):
+    """One typed row per commute (simple or chained), oldest first.
+
+    Columns: Date (datetime64, UTC start of the first ride), Type and Weekday
+    (categoricals), Distance (km) (float64, summed over a chain), Rides (int64),
+    Name and IDs.
+    """
+    import pandas as pd
+
+    chains = [c if isinstance(c, list) else [c] for c in commutes]
+    rides = [r for chain in chains for r in chain]
+    sizes = np.fromiter((len(chain) for chain in chains), dtype=np.int64, count=len(chains))
+    ends = np.cumsum(sizes)
+    firsts = ends - sizes
+
+    # Each commute is a contiguous run of rides: sum them in one pass
+    distance = np.fromiter((r.distance for r in rides), dtype=float, count=len(rides))
+    distance_km = np.add.reduceat(distance, firsts) / 1000.0 if len(chains) else distance
+    start_ts = np.fromiter((chain[0].start_date.timestamp() for chain in chains), dtype=float, count=len(chains))
+    dates = pd.to_datetime(start_ts, unit='s')
+    ids = [r.id for r in rides]
+    frame = pd.DataFrame({
+        'Date': dates.astype('datetime64[us]'),
+        'Type': pd.Categorical.from_codes((sizes > 1).astype(np.int8), categories=COMMUTE_TYPES),
+        'Weekday': pd.Categorical.from_codes(dates.dayofweek.to_numpy(), categories=WEEKDAYS, ordered=True),
+        'Distance (km)': distance_km,
+        'Rides': sizes,
+        'Name': [chain[0].name if len(chain) == 1 else ", ".join(r.name for r in chain) for chain in chains],
+        'IDs': [ids[a:b] for a, b in zip(firsts.tolist(), ends.tolist())],
+    })
+    return frame.sort_values('Date', kind='stable', ignore_index=True)
+
+
+def commute_rollups(frame):
+    """Commute count and distance per day, week, month and year, plus counts per weekday.
+
+    The commutes are grouped by day once; the longer periods roll up those daily totals.
+    Returns a dict of frames indexed by period start ('daily', 'weekly', 'monthly',
+    'yearly') with Commutes and Distance (km) columns, and 'weekday' indexed by weekday.
+    """
+    daily = (frame.groupby(frame['Date'].dt.floor('D'))
+             .agg(**{'Commutes': ('Rides', 'size'), 'Distance (km)': ('Distance (km)', 'sum')}))
+    daily.index.name = 'Date'
+    rollups = {'daily': daily}
+    # Weeks run Monday to Sunday
+    for name, freq in (('weekly', 'W-SUN'), ('monthly', 'M'), ('yearly', 'Y')):
+        rolled = daily.groupby(daily.index.to_period(freq)).sum()
+        rolled.index = rolled.index.start_time
+        rolled.index.name = 'Date'
+        rollups[name] = rolled
+    rollups['weekday'] = (frame.groupby('Weekday', observed=False).size()
+                          .rename('Commutes').to_frame())
+    return rollups
+
+
+def chart_period(rollups):
+    """Finest of 'weekly', 'monthly', 'yearly' that keeps the distance chart readable."""
+    daily = rollups['daily']
+    span_days = (daily.index[-1] - daily.index[0]).days if len(daily) else 0
+    if span_days / 7 < MAX_WEEKLY_BARS:
+        return 'weekly'
+    if span_days / 30.4 < MAX_MONTHLY_BARS:
+        return 'monthly'
+    return 'yearly'
@@ -0,0 +1,186 @@
+import csv
+import functools
+import io
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+
+# Raw spans kept for the diagnostics page and exports
+MAX_SPANS = 5000
+
+RATE_LIMIT_HEADERS = (
+    'X-RateLimit-Limit', 'X-RateLimit-Usage',
+    'X-ReadRateLimit-Limit', 'X-ReadRateLimit-Usage',
+)
+
+
+class _NullSpan:
+    """Shared no-op context manager returned while instrumentation is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('owner', 'name', 'meta', 'start')
+
+    def __init__(self, owner, name, meta):
+        self.owner = owner
+        self.name = name
+        self.meta = meta
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        self.owner._add_span(self.name, duration, self.meta, error=exc_type is not None)
+        return False
+
+
+def _endpoint(method, url):
+    """'GET /athlete/activities' style key, with numeric ids collapsed."""
+    path = re.sub(r'^https?://[^/]+', '', url).split('?')[0]
+    path = re.sub(r'^/api/v3', '', path)
+    path = re.sub(r'/\d+', '/{id}', path)
+    return f"{method} {path}"
+
+
+class Instrumentation:
+    """Timing spans, counters and Strava API call stats for the analysis pipeline.
+
+    When disabled, span() returns a shared no-op context manager and count() returns
+    immediately, so instrumented code pays a single attribute check.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.spans = deque(maxlen=MAX_SPANS)
+            self.counters = {}
+            self.api_calls = {}
+            self.rate_limits = {}
+
+    def span(self, name, **meta):
+        """Context manager timing the enclosed block as one span."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, meta)
+
+    def timed(self, name):
+        """Decorator recording each call of the wrapped function as a span."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Span(self, name, {}):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def _add_span(self, name, duration, meta, error=False):
+        entry = {
+            'name': name,
+            'start': time.time() - duration,
+            'seconds': duration,
+            'thread': threading.current_thread().name,
+            'error': error,
+        }
+        entry.update(meta)
+        with self._lock:
+            self.spans.append(entry)
+
+    def record_response(self, response, *args, **kwargs):
+        """requests response hook: counts API calls per endpoint and keeps the latest rate-limit headers."""
+        if not self.enabled:
+            return response
+        key = _endpoint(response.request.method, response.url)
+        seconds = response.elapsed.total_seconds()
+        with self._lock:
+            stats = self.api_calls.setdefault(key, {'calls': 0, 'seconds': 0.0, 'status': {}})
+            stats['calls'] += 1
+            stats['seconds'] += seconds
+            stats['status'][str(response.status_code)] = stats['status'].get(str(response.status_code), 0) + 1
+            headers = {h: response.headers[h] for h in RATE_LIMIT_HEADERS if h in response.headers}
+            if headers:
+                headers['seen_at'] = time.time()
+                self.rate_limits = headers
+        self.count('api.requests')
+        return response
+
+    def attach(self, session):
+        """Install the response hook on a requests.Session (idempotent)."""
+        hooks = session.hooks.setdefault('response', [])
+        if self.record_response not in hooks:
+            hooks.append(self.record_response)
+
+    def summary(self):
+        """Per-span-name aggregates: count, total, mean, p95 and max seconds."""
+        with self._lock:
+            spans = list(self.spans)
+        by_name = {}
+        for s in spans:
+            by_name.setdefault(s['name'], []).append(s['seconds'])
+        rows = []
+        for name, durations in by_name.items():
+            durations.sort()
+            rows.append({
+                'name': name,
+                'count': len(durations),
+                'total_seconds': sum(durations),
+                'mean_seconds': sum(durations) / len(durations),
+                'p95_seconds': durations[min(len(durations) - 1, int(0.95 * len(durations)))],
+                'max_seconds': durations[-1],
+            })
+        return sorted(rows, key=lambda r: r['total_seconds'], reverse=True)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'spans': list(self.spans),
+                'counters': dict(self.counters),
+                'api_calls': {k: dict(v, status=dict(v['status'])) for k, v in self.api_calls.items()},
+                'rate_limits': dict(self.rate_limits),
+            }
+
+    def to_json(self):
+        data = self.snapshot()
+        data['summary'] = self.summary()
+        return json.dumps(data, indent=4, default=str)
+
+    def to_csv(self):
+        """Raw spans as CSV (one row per span, metadata columns unioned)."""
+        spans = self.snapshot()['spans']
+        columns = ['name', 'start', 'seconds', 'thread', 'error']
+        for s in spans:
+            columns.extend(k for k in s if k not in columns)
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(spans)
+        return out.getvalue()
+
+
+instrumentation = Instrumentation(enabled=os.getenv("STRAVA_INSTRUMENTATION", "").lower() in ("1", "true", "yes"))
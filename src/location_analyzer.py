@@ -1,11 +1,46 @@
 import numpy as np
-from sklearn.cluster import DBSCAN
-from geopy.distance import geodesic
+from .rides import RideTable
+from .instrumentation import instrumentation
+
+EARTH_RADIUS_METERS = 6371008.8
+
+
+def haversine_meters(lat1, lon1, lat2, lon2):
+    """Vectorized great-circle distance in meters between arrays of degree coordinates.
+
+    Uses a spherical Earth, so it differs from geopy's ellipsoidal geodesic by
+    at most ~0.5% (about 1.5 m at a 300 m radius). NaN inputs yield NaN.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def unit_vectors(coords):
+    """(N, 3) points on the unit sphere for (N, 2) lat/lng degrees.
+
+    Euclidean (chord) distance between them is monotonic in great-circle distance,
+    so a plain KD-tree answers nearest-neighbour queries exactly.
+    """
+    lat, lng = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+    return np.column_stack([np.cos(lat) * np.cos(lng), np.cos(lat) * np.sin(lng), np.sin(lat)])
+
+
+def ride_points(activities):
+    """(M, 2) array of all known start and end points of the rides, in ride order."""
+    table = RideTable.of(activities)
+    coords = np.stack([table.start_coords, table.end_coords], axis=1).reshape(-1, 2)
+    return coords[~np.isnan(coords).any(axis=1)]
+
 
 class LocationAnalyzer:
-    def __init__(self, eps_meters=200, min_samples=2):
+    def __init__(self, eps_meters=200, min_samples=2, snap_meters=None):
         self.eps_km = eps_meters / 1000.0
         self.min_samples = min_samples
+        # Opt-in approximation for very large histories: points are snapped to a grid of this
+        # size and clustered as weighted cells, so DBSCAN memory depends on the area covered
+        # rather than the number of rides. Points up to ~1.5 cells either side of eps can
+        # change cluster; by default (None) every point is clustered exactly.
+        self.snap_meters = snap_meters
 
     def _robust_latlng(self, latlng):
         if latlng is None:
@@ -24,119 +59,124 @@ class LocationAnalyzer:
                 pass
         return None
 
+    @instrumentation.timed('clustering')
     def estimate_locations(self, activities):
         if not activities:
             return None, None
+        table = RideTable.of(activities)
 
-        # 1. Collect all points for clustering
-        point_data = [] # List of (coords, activity, is_start)
-        for activity in activities:
-            start = self._robust_latlng(activity.start_latlng)
-            if start:
-                point_data.append({'coords': start, 'activity': activity, 'is_start': True})
-            end = self._robust_latlng(activity.end_latlng)
-            if end:
-                point_data.append({'coords': end, 'activity': activity, 'is_start': False})
-
-        if not point_data:
+        # 1. Cluster all start and end points
+        centers, _ = self.cluster_points(ride_points(table))
+        if len(centers) == 0:
             return None, None
 
-        coords = np.array([p['coords'] for p in point_data])
-        coords_rad = np.radians(coords)
-        
-        # DBSCAN clustering
+        # 2. Score clusters by daily home/work roles
+        home_scores, visits = self.score_clusters(table, centers)
+        return self.pick_home_work(centers, home_scores, visits)
+
+    def cluster_points(self, coords):
+        """DBSCAN over (N, 2) lat/lng points: (K, 2) cluster centers and (K,) member counts."""
+        if len(coords) == 0:
+            return np.empty((0, 2)), np.empty(0, dtype=np.int64)
+
+        # DBSCAN clustering on weighted grid cells (one row per occupied cell)
+        cells, inverse, weights = self._snap(coords)
         kms_per_radian = 6371.0088
         epsilon = self.eps_km / kms_per_radian
-        db = DBSCAN(eps=epsilon, min_samples=self.min_samples, metric='haversine', algorithm='ball_tree').fit(coords_rad)
-        labels = db.labels_
-
-        # 2. Group by day and count cluster roles
-        from collections import defaultdict
-        
-        # Map each point_data index to its cluster label
-        clusters = {}
-        for i, label in enumerate(labels):
-            if label != -1:
-                if label not in clusters:
-                    clusters[label] = []
-                clusters[label].append(point_data[i])
-
-        if not clusters:
-            return None, None
-
-        # Sort activities by date
-        sorted_activities = sorted(activities, key=lambda a: a.start_date)
-        by_day = defaultdict(list)
-        for a in sorted_activities:
-            day = a.start_date.date()
-            by_day[day].append(a)
-
-        # Count how often each cluster is a "home" candidate (start of first ride or end of last ride)
-        # and "work" candidate (mid-day point)
-        home_scores = defaultdict(int)
-        overall_counts = defaultdict(int)
-        
-        # Helper to get cluster for a coordinate
-        def get_cluster(latlng):
-            if latlng is None: return -1
-            p = self._robust_latlng(latlng)
-            # Find closest cluster center
-            best_dist = float('inf')
-            best_label = -1
-            for label, data_list in clusters.items():
-                center = np.mean([pl['coords'] for pl in data_list], axis=0)
-                center_coords = (float(center[0]), float(center[1]))
-                dist = geodesic(p, center_coords).meters
-                if dist < 300 and dist < best_dist:
-                    best_dist = dist
-                    best_label = label
-            return best_label
-
-        for day, day_activities in by_day.items():
-            first_ride = day_activities[0]
-            last_ride = day_activities[-1]
-            
-            c_start = get_cluster(first_ride.start_latlng)
-            c_end = get_cluster(last_ride.end_latlng)
-            
-            if c_start != -1: home_scores[c_start] += 1
-            if c_end != -1: home_scores[c_end] += 1
-            
-            for a in day_activities:
-                s = get_cluster(a.start_latlng)
-                e = get_cluster(a.end_latlng)
-                if s != -1: overall_counts[s] += 1
-                if e != -1: overall_counts[e] += 1
-
-        # Calculate cluster centers
-        cluster_centers = {}
-        for label, data_list in clusters.items():
-            cluster_centers[label] = np.mean([p['coords'] for p in data_list], axis=0).tolist()
-
-        # Decide Home: Highest home_score
-        if not home_scores:
+        from sklearn.cluster import DBSCAN
+
+        db = DBSCAN(eps=epsilon, min_samples=self.min_samples, metric='haversine', algorithm='ball_tree')
+        with instrumentation.span('clustering.dbscan', points=len(coords), cells=len(cells)):
+            db.fit(np.radians(cells), sample_weight=weights)
+        labels = db.labels_[inverse]
+
+        clustered = labels != -1
+        counts = np.bincount(labels[clustered])
+        sums = np.stack([np.bincount(labels[clustered], weights=coords[clustered, k], minlength=len(counts))
+                         for k in range(2)], axis=1)
+        occupied = np.flatnonzero(counts)
+        return sums[occupied] / counts[occupied, None], counts[occupied]
+
+    def score_clusters(self, activities, centers):
+        """Per-cluster (home scores, visits) for the rides.
+
+        A cluster scores a home point when it holds the start of a day's first ride or
+        the end of its last ride; visits count every start/end point near the cluster.
+        """
+        table = RideTable.of(activities)
+        return self.score_points(table.start_ts, table.start_coords, table.end_coords, centers)
+
+    def score_points(self, start_ts, start_coords, end_coords, centers):
+        """score_clusters over rides given as start timestamps and (N, 2) start/end coordinates."""
+        k = len(centers)
+        if len(start_ts) == 0 or k == 0:
+            return np.zeros(k, dtype=np.int64), np.zeros(k, dtype=np.int64)
+
+        # Assign every start/end point to its nearest cluster center in one bulk query
+        start_labels = np.array(self._nearest_cluster(centers, start_coords))
+        end_labels = np.array(self._nearest_cluster(centers, end_coords))
+
+        # First and last ride of each (UTC) day
+        order = np.argsort(start_ts, kind='stable')
+        days = np.floor(start_ts[order] / 86400.0)
+        firsts = order[np.flatnonzero(np.r_[True, days[1:] != days[:-1]])]
+        lasts = order[np.flatnonzero(np.r_[days[1:] != days[:-1], True])]
+
+        home_points = np.concatenate([start_labels[firsts], end_labels[lasts]])
+        all_points = np.concatenate([start_labels, end_labels])
+        home_scores = np.bincount(home_points[home_points != -1], minlength=k)
+        visits = np.bincount(all_points[all_points != -1], minlength=k)
+        return home_scores, visits
+
+    def pick_home_work(self, centers, home_scores, visits):
+        """Home is the cluster with the highest home score; work the most visited of the rest."""
+        if not home_scores.any():
             # Fallback to overall counts if no daily patterns found
-            sorted_by_count = sorted(overall_counts.items(), key=lambda x: x[1], reverse=True)
-            home_label = sorted_by_count[0][0]
-            work_label = sorted_by_count[1][0] if len(sorted_by_count) > 1 else -1
+            ranked = [l for l in np.argsort(-visits, kind='stable') if visits[l] > 0]
+            if not ranked:
+                return None, None
+            home_label = ranked[0]
+            work_label = ranked[1] if len(ranked) > 1 else -1
         else:
-            sorted_home = sorted(home_scores.items(), key=lambda x: x[1], reverse=True)
-            home_label = sorted_home[0][0]
-            
-            # Decide Work: Highest overall count among remaining clusters
-            other_clusters = [(l, c) for l, c in overall_counts.items() if l != home_label]
-            if other_clusters:
-                sorted_work = sorted(other_clusters, key=lambda x: x[1], reverse=True)
-                work_label = sorted_work[0][0]
-            else:
-                work_label = -1
-
-        home = cluster_centers[home_label]
-        work = cluster_centers[work_label] if work_label != -1 else None
+            home_label = int(np.argmax(home_scores))
+            others = np.where(np.arange(len(visits)) != home_label, visits, 0)
+            work_label = int(np.argmax(others)) if others.any() else -1
 
+        home = centers[home_label].tolist()
+        work = centers[work_label].tolist() if work_label != -1 else None
         return home, work
 
+    def _snap(self, coords):
+        """Collapse points into grid cells: (cell centers, point -> cell index, points per cell)."""
+        if not self.snap_meters:
+            return coords, np.arange(len(coords)), np.ones(len(coords))
+        cell_lat = self.snap_meters / 111320.0
+        cell_lng = cell_lat / max(np.cos(np.radians(coords[:, 0].mean())), 0.01)
+        keys = np.floor(coords / (cell_lat, cell_lng)).astype(np.int64)
+        unique_keys, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+        return (unique_keys + 0.5) * (cell_lat, cell_lng), inverse.ravel(), counts.astype(float)
+
+    def _nearest_cluster(self, centers, coords, max_meters=300):
+        """Index of the nearest of the (K, 2) centers within max_meters for each (N, 2) coordinate row, else -1.
+
+        Queries a KD-tree over the centers as unit vectors for all points at once; the
+        nearest chord is the nearest great-circle neighbour, converted back to meters.
+        """
+        from sklearn.neighbors import KDTree
+
+        tree = KDTree(unit_vectors(np.asarray(centers, dtype=float).reshape(-1, 2)))
+
+        result = np.full(len(coords), -1, dtype=np.int64)
+        valid = ~np.isnan(coords).any(axis=1)
+        if valid.any():
+            chord, idx = tree.query(unit_vectors(coords[valid]), k=1)
+            meters = 2.0 * np.arcsin(np.clip(chord[:, 0] / 2.0, 0.0, 1.0)) * EARTH_RADIUS_METERS
+            result[valid] = np.where(meters < max_meters, idx[:, 0], -1)
+        return result.tolist()
+
     def is_near(self, point1, point2, radius_meters=300):
+        from geopy.distance import geodesic
+
         p1 = self._robust_latlng(point1)
         p2 = self._robust_latlng(point2)
         if p1 is None or p2 is None:
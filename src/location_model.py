@@ -0,0 +1,200 @@
+import os
+import sqlite3
+import time
+from contextlib import closing
+import numpy as np
+from .location_analyzer import LocationAnalyzer, ride_points
+from .rides import RideTable
+from .instrumentation import instrumentation
+
+MODEL_PATH = "data/location_models.db"
+
+SCHEMA_VERSION = 2
+
+# New points within this distance of a known cluster center join that cluster
+ASSIGN_METERS = 300
+# Unclustered points kept for later updates to build new clusters from (most recent kept)
+MAX_PENDING_POINTS = 10000
+
+
+def _blob(array):
+    return np.ascontiguousarray(array).tobytes()
+
+
+class LocationModel:
+    """Per-athlete home/work model: cluster centroids, member counts, visits and home scores.
+
+    update() clusters only rides it has not seen before: their points join the nearest
+    known cluster (moving its centroid) or, together with earlier unclustered points,
+    are clustered into new ones. Every seen ride's start time and end points are kept,
+    and visits and home scores are recomputed over all of them after each update, so a
+    day split across updates is scored once, by its actual first and last ride, and
+    rides whose points only form a cluster later count towards it.
+    """
+
+    def __init__(self, centers=None, counts=None, visits=None, home_scores=None, pending=None, ride_ids=None,
+                 ride_ts=None, ride_coords=None):
+        self.centers = np.empty((0, 2)) if centers is None else np.array(centers, dtype=float).reshape(-1, 2)
+        k = len(self.centers)
+        self.counts = np.zeros(k, dtype=np.int64) if counts is None else np.array(counts, dtype=np.int64)
+        self.visits = np.zeros(k, dtype=np.int64) if visits is None else np.array(visits, dtype=np.int64)
+        self.home_scores = np.zeros(k, dtype=np.int64) if home_scores is None else np.array(home_scores, dtype=np.int64)
+        self.pending = np.empty((0, 2)) if pending is None else np.array(pending, dtype=float).reshape(-1, 2)
+        self.ride_ids = np.empty(0, dtype=np.int64) if ride_ids is None else np.array(ride_ids, dtype=np.int64)
+        # Start timestamp and start/end lat/lng (NaN if unknown) of each seen ride, for rescoring
+        self.ride_ts = np.empty(0) if ride_ts is None else np.array(ride_ts, dtype=float)
+        self.ride_coords = np.empty((0, 4)) if ride_coords is None else np.array(ride_coords, dtype=float).reshape(-1, 4)
+
+    @classmethod
+    def build(cls, activities, analyzer=None):
+        """Model re-clustered from scratch over the given rides (e.g. an athlete's full history)."""
+        model = cls()
+        model.update(activities, analyzer)
+        return model
+
+    @instrumentation.timed('clustering.model_update')
+    def update(self, activities, analyzer=None):
+        """Fold unseen rides into the model; returns how many were new."""
+        analyzer = analyzer or LocationAnalyzer()
+        table = RideTable.of(activities)
+        # A ride listed twice in one batch is only new once
+        _, first = np.unique(table.ids, return_index=True)
+        new = np.zeros(len(table), dtype=bool)
+        new[first] = True
+        new &= ~np.isin(table.ids, self.ride_ids)
+        if not new.any():
+            return 0
+        table = RideTable(table.take(new))
+        points = ride_points(table)
+
+        # 1. Points near a known cluster move its centroid (running mean)
+        labels = np.full(len(points), -1)
+        if len(self.centers):
+            labels = np.array(analyzer._nearest_cluster(self.centers, points, ASSIGN_METERS))
+        assigned = labels != -1
+        if assigned.any():
+            k = len(self.centers)
+            added = np.bincount(labels[assigned], minlength=k)
+            sums = np.stack([np.bincount(labels[assigned], weights=points[assigned, i], minlength=k)
+                             for i in range(2)], axis=1)
+            total = self.counts + added
+            grown = added > 0
+            self.centers[grown] = (self.centers[grown] * self.counts[grown, None] + sums[grown]) / total[grown, None]
+            self.counts = total
+
+        # 2. The rest are clustered together with earlier leftovers into new clusters
+        candidates = np.concatenate([self.pending, points[~assigned]])
+        if len(candidates):
+            centers, counts = analyzer.cluster_points(candidates)
+            self.centers = np.concatenate([self.centers, centers])
+            self.counts = np.concatenate([self.counts, counts])
+            self.visits = np.concatenate([self.visits, np.zeros(len(centers), dtype=np.int64)])
+            self.home_scores = np.concatenate([self.home_scores, np.zeros(len(centers), dtype=np.int64)])
+            left = np.ones(len(candidates), dtype=bool)
+            if len(centers):
+                left = np.array(analyzer._nearest_cluster(centers, candidates, ASSIGN_METERS)) == -1
+            self.pending = candidates[left][-MAX_PENDING_POINTS:]
+
+        # 3. Rescore every seen ride against the updated clusters
+        self.ride_ids = np.concatenate([self.ride_ids, table.ids])
+        self.ride_ts = np.concatenate([self.ride_ts, table.start_ts])
+        self.ride_coords = np.concatenate([self.ride_coords, np.hstack([table.start_coords, table.end_coords])])
+        self.home_scores, self.visits = analyzer.score_points(
+            self.ride_ts, self.ride_coords[:, :2], self.ride_coords[:, 2:], self.centers)
+        return len(table)
+
+    def locations(self, analyzer=None):
+        """Current (home, work) estimate, each [lat, lng] or None."""
+        if len(self.centers) == 0:
+            return None, None
+        return (analyzer or LocationAnalyzer()).pick_home_work(self.centers, self.home_scores, self.visits)
+
+    def __len__(self):
+        return len(self.centers)
+
+
+class LocationModelStore:
+    """SQLite persistence of one LocationModel per athlete."""
+
+    def __init__(self, path=MODEL_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                # Earlier models kept no per-ride points to rescore from; they are rebuilt from
+                # the next analysis (or from the stored history with Re-cluster)
+                conn.execute("DROP TABLE IF EXISTS location_models")
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS location_models (
+                    athlete_id INTEGER PRIMARY KEY,
+                    centers BLOB NOT NULL,
+                    counts BLOB NOT NULL,
+                    visits BLOB NOT NULL,
+                    home_scores BLOB NOT NULL,
+                    pending BLOB NOT NULL,
+                    ride_ids BLOB NOT NULL,
+                    ride_ts BLOB NOT NULL,
+                    ride_coords BLOB NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, athlete_id):
+        """The athlete's stored model, or None."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT centers, counts, visits, home_scores, pending, ride_ids, ride_ts, ride_coords "
+                "FROM location_models WHERE athlete_id = ?",
+                (athlete_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        centers, counts, visits, home_scores, pending, ride_ids, ride_ts, ride_coords = row
+        return LocationModel(
+            centers=np.frombuffer(centers, dtype=float),
+            counts=np.frombuffer(counts, dtype=np.int64),
+            visits=np.frombuffer(visits, dtype=np.int64),
+            home_scores=np.frombuffer(home_scores, dtype=np.int64),
+            pending=np.frombuffer(pending, dtype=float),
+            ride_ids=np.frombuffer(ride_ids, dtype=np.int64),
+            ride_ts=np.frombuffer(ride_ts, dtype=float),
+            ride_coords=np.frombuffer(ride_coords, dtype=float),
+        )
+
+    def put(self, athlete_id, model):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO location_models VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (athlete_id, _blob(model.centers), _blob(model.counts), _blob(model.visits),
+                 _blob(model.home_scores), _blob(model.pending), _blob(model.ride_ids),
+                 _blob(model.ride_ts), _blob(model.ride_coords), time.time()),
+            )
+
+    def delete(self, athlete_id):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM location_models WHERE athlete_id = ?", (athlete_id,))
+
+
+def update_locations(athlete_id, activities, model_store=None, analyzer=None):
+    """Fold rides into the athlete's persisted model and return its (home, work)."""
+    model_store = model_store or LocationModelStore()
+    model = model_store.get(athlete_id)
+    if model is None:
+        model = LocationModel()
+    if model.update(activities, analyzer):
+        model_store.put(athlete_id, model)
+    return model.locations(analyzer)
+
+
+def rebuild_locations(athlete_id, activities, model_store=None, analyzer=None):
+    """Replace the athlete's model with one re-clustered over activities; returns (home, work)."""
+    model_store = model_store or LocationModelStore()
+    model = LocationModel.build(activities, analyzer)
+    model_store.put(athlete_id, model)
+    return model.locations(analyzer)
@@ -1,47 +1,87 @@
 import os
 import json
+import sqlite3
+import tempfile
+import datetime
+from contextlib import closing, contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: writes within one process are still serialized below
+    fcntl = None
 
 LOG_DIR = "data/logs"
+LOG_DB_PATH = "data/logs.db"
+# Per-athlete JSON partitions live under LOG_DIR/athletes/<athlete_id>/YYYY/MM.json
+ATHLETE_LOG_DIR = os.path.join(LOG_DIR, "athletes")
 
-class LogManager:
-    def __init__(self):
-        os.makedirs(LOG_DIR, exist_ok=True)
+# Logs saved before storage was partitioned per athlete belong to no athlete until claimed
+UNASSIGNED_ATHLETE_ID = 0
 
-    def _get_path(self, year, month):
-        year_dir = os.path.join(LOG_DIR, str(year))
-        os.makedirs(year_dir, exist_ok=True)
-        return os.path.join(year_dir, f"{month:02d}.json")
+SCHEMA_VERSION = 2
 
-    def upsert_log(self, year, month, analysis_data):
-        path = self._get_path(year, month)
-        
-        # Merge if exists
-        if os.path.exists(path):
-            with open(path, 'r') as f:
-                existing_data = json.load(f)
-            
-            # Simple merge: new data overwrites existing keys
-            existing_data.update(analysis_data)
-            analysis_data = existing_data
 
-        with open(path, 'w') as f:
-            json.dump(analysis_data, f, indent=4)
+@contextmanager
+def _file_lock(path):
+    """Exclusive advisory lock on path (created if missing) for the duration of the block."""
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
 
-    def get_log(self, year, month):
+
+class JsonLogBackend:
+    """One pretty-printed JSON file per month under root/YYYY/MM.json."""
+
+    def __init__(self, root=LOG_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _get_path(self, year, month):
+        return os.path.join(self.root, str(year), f"{month:02d}.json")
+
+    def get(self, year, month):
         path = self._get_path(year, month)
         if os.path.exists(path):
             with open(path, 'r') as f:
                 return json.load(f)
         return None
 
-    def list_logs(self):
+    def put(self, year, month, data):
+        """Write a month atomically (temp file + rename), replacing any existing log."""
+        path = self._get_path(year, month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, indent=4)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def upsert(self, year, month, data):
+        """Merge into the existing log while holding the partition's lock file."""
+        with _file_lock(os.path.join(self.root, ".lock")):
+            existing_data = self.get(year, month)
+            if existing_data is not None:
+                # Simple merge: new data overwrites existing keys
+                existing_data.update(data)
+                data = existing_data
+            self.put(year, month, data)
+
+    def list(self):
         logs = []
-        if not os.path.exists(LOG_DIR):
+        if not os.path.exists(self.root):
             return logs
-            
-        for year in os.listdir(LOG_DIR):
-            year_path = os.path.join(LOG_DIR, year)
-            if os.path.isdir(year_path):
+
+        for year in os.listdir(self.root):
+            year_path = os.path.join(self.root, year)
+            if os.path.isdir(year_path) and year.isdigit():
                 for month_file in os.listdir(year_path):
                     if month_file.endswith(".json"):
                         month = int(month_file.replace(".json", ""))
@@ -51,3 +91,224 @@ class LogManager:
                             'path': os.path.join(year_path, month_file)
                         })
         return sorted(logs, key=lambda x: (x['year'], x['month']), reverse=True)
+
+    def range(self, start, end):
+        """Logs for (year, month) keys in [start, end], oldest first."""
+        keys = sorted((l['year'], l['month']) for l in self.list())
+        return [{'year': y, 'month': m, 'data': self.get(y, m)} for y, m in keys if start <= (y, m) <= end]
+
+
+class SqliteLogBackend:
+    """One athlete's logs as JSON documents in a SQLite table keyed by (athlete_id, year, month).
+
+    Every query is confined to the athlete's rows through the primary key index. Writes
+    are single short transactions and upserts take the write lock up front (BEGIN
+    IMMEDIATE), so concurrent sessions never interleave a read-merge-write.
+    """
+
+    def __init__(self, path=LOG_DB_PATH, athlete_id=UNASSIGNED_ATHLETE_ID):
+        self.path = path
+        self.athlete_id = athlete_id
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn:
+            # Only an outdated database takes the write lock; opening a current one is a plain read
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Another session may have migrated while this one waited for the lock
+                if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                    self._migrate(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _migrate(self, conn):
+        """Create the per-athlete table, moving logs from the shared layout to the unassigned athlete."""
+        shared = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'logs'").fetchone()
+        if shared:
+            conn.execute("ALTER TABLE logs RENAME TO logs_shared")
+        conn.execute("""
+            CREATE TABLE logs (
+                athlete_id INTEGER NOT NULL,
+                year INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (athlete_id, year, month)
+            )
+        """)
+        if shared:
+            conn.execute(
+                "INSERT INTO logs SELECT ?, year, month, data, updated_at FROM logs_shared",
+                (UNASSIGNED_ATHLETE_ID,),
+            )
+            conn.execute("DROP TABLE logs_shared")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get(self, year, month):
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT data FROM logs WHERE athlete_id = ? AND year = ? AND month = ?",
+                (self.athlete_id, year, month),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write(self, conn, year, month, data):
+        conn.execute(
+            "INSERT OR REPLACE INTO logs (athlete_id, year, month, data, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (self.athlete_id, year, month, json.dumps(data), datetime.datetime.now().isoformat()),
+        )
+
+    def put(self, year, month, data):
+        with closing(self._connect()) as conn:
+            self._write(conn, year, month, data)
+
+    def upsert(self, year, month, data):
+        """Merge into the existing log in a single write transaction."""
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT data FROM logs WHERE athlete_id = ? AND year = ? AND month = ?",
+                    (self.athlete_id, year, month),
+                ).fetchone()
+                if row:
+                    # Simple merge: new data overwrites existing keys
+                    existing_data = json.loads(row[0])
+                    existing_data.update(data)
+                    data = existing_data
+                self._write(conn, year, month, data)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def list(self):
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT year, month FROM logs WHERE athlete_id = ? ORDER BY year DESC, month DESC",
+                (self.athlete_id,),
+            ).fetchall()
+        return [{'year': year, 'month': month} for year, month in rows]
+
+    def range(self, start, end):
+        """Logs for (year, month) keys in [start, end], oldest first."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT year, month, data FROM logs WHERE athlete_id = ? "
+                "AND (year, month) >= (?, ?) AND (year, month) <= (?, ?) ORDER BY year, month",
+                (self.athlete_id, start[0], start[1], end[0], end[1]),
+            ).fetchall()
+        return [{'year': year, 'month': month, 'data': json.loads(data)} for year, month, data in rows]
+
+    def is_empty(self, all_athletes=False):
+        query, params = "SELECT 1 FROM logs WHERE athlete_id = ? LIMIT 1", (self.athlete_id,)
+        if all_athletes:
+            query, params = "SELECT 1 FROM logs LIMIT 1", ()
+        with closing(self._connect()) as conn:
+            return conn.execute(query, params).fetchone() is None
+
+    def claim(self, from_athlete_id, months=None):
+        """Move another partition's logs (or just the given (year, month) keys) into this athlete's.
+
+        Months this athlete already has are kept; the other partition's copies are dropped.
+        """
+        where, params = "athlete_id = ?", [from_athlete_id]
+        if months is not None:
+            months = list(months)
+            if not months:
+                return 0
+            where += " AND (year, month) IN (VALUES " + ", ".join("(?, ?)" for _ in months) + ")"
+            params += [value for key in months for value in key]
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                moved = conn.execute(
+                    f"INSERT OR IGNORE INTO logs SELECT ?, year, month, data, updated_at FROM logs WHERE {where}",
+                    [self.athlete_id] + params,
+                ).rowcount
+                conn.execute(f"DELETE FROM logs WHERE {where}", params)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return moved
+
+
+class LogManager:
+    """Analysis logs of one athlete (athlete_id None means logs not yet assigned to anyone)."""
+
+    def __init__(self, athlete_id=None, backend=None):
+        self.athlete_id = UNASSIGNED_ATHLETE_ID if athlete_id is None else athlete_id
+        self.backend = backend or SqliteLogBackend(athlete_id=self.athlete_id)
+        # One-time migration of logs written by the shared JSON layout
+        if backend is None and self.backend.is_empty(all_athletes=True) and os.path.isdir(LOG_DIR):
+            LogManager(UNASSIGNED_ATHLETE_ID, SqliteLogBackend(self.backend.path)).import_json(LOG_DIR)
+
+    def upsert_log(self, year, month, analysis_data):
+        self.backend.upsert(year, month, analysis_data)
+
+    def get_log(self, year, month):
+        return self.backend.get(year, month)
+
+    def list_logs(self):
+        return self.backend.list()
+
+    def get_logs(self, start, end):
+        """Logs for every stored month between (year, month) start and end, inclusive."""
+        return self.backend.range(start, end)
+
+    def unassigned_count(self):
+        """Number of logs saved before per-athlete storage that no athlete has claimed yet."""
+        if self.athlete_id == UNASSIGNED_ATHLETE_ID or not isinstance(self.backend, SqliteLogBackend):
+            return 0
+        return len(SqliteLogBackend(self.backend.path).list())
+
+    def verified_unassigned(self, activity_ids):
+        """(year, month) keys of unclaimed logs whose commutes are all among this athlete's activity_ids.
+
+        The old shared logs name no athlete, so a log counts as this athlete's only when every
+        activity it lists is known to be theirs. Logs without commutes cannot be verified.
+        """
+        if self.athlete_id == UNASSIGNED_ATHLETE_ID or not isinstance(self.backend, SqliteLogBackend):
+            return []
+        activity_ids = set(activity_ids)
+        unassigned = SqliteLogBackend(self.backend.path)
+        return [(log['year'], log['month']) for log in unassigned.range((0, 0), (9999, 12))
+                if log['data'].get('commute_activity_ids')
+                and activity_ids.issuperset(log['data']['commute_activity_ids'])]
+
+    def claim_unassigned(self, months=None):
+        """Move unclaimed logs (all, or the given (year, month) keys) into this athlete's partition.
+
+        Returns the count moved. Pass the keys from verified_unassigned() unless the logs are
+        known to be this athlete's, as the `logs claim` CLI command does for an operator.
+        """
+        return self.backend.claim(UNASSIGNED_ATHLETE_ID, months)
+
+    def import_json(self, root=LOG_DIR):
+        """Copy logs from the YYYY/MM.json layout into the current backend. Returns the count."""
+        source = JsonLogBackend(root)
+        logs = source.list()
+        for log in logs:
+            self.backend.put(log['year'], log['month'], source.get(log['year'], log['month']))
+        return len(logs)
+
+    def export_json(self, root=None):
+        """Write every log to the YYYY/MM.json layout (default: the athlete's JSON partition). Returns the count."""
+        if root is None:
+            root = os.path.join(ATHLETE_LOG_DIR, str(self.athlete_id))
+        target = JsonLogBackend(root)
+        logs = self.list_logs()
+        for log in logs:
+            target.put(log['year'], log['month'], self.get_log(log['year'], log['month']))
+        return len(logs)
@@ -0,0 +1,104 @@
+import datetime
+from .location_analyzer import LocationAnalyzer
+from .commute_detector import CommuteDetector
+from .rides import RideTable
+from .route_index import split_detours
+
+# Defaults shared by the analyze page and the CLI
+DEFAULT_RADIUS_METERS = 300
+DEFAULT_MAX_GAP_HOURS = 6
+
+
+def flatten_commutes(commutes):
+    """Individual activities of a commute list where chains are nested lists."""
+    activities = []
+    for c in commutes:
+        if isinstance(c, list):
+            activities.extend(c)
+        else:
+            activities.append(c)
+    return activities
+
+
+def month_logs(rides, commutes, home, work, timestamp=None):
+    """Log documents keyed by (year, month).
+
+    A commute is counted in the month it starts in, while its activities (ids, distance)
+    go to the month each ride starts in. Only rides are logged: edge rides completing a
+    chain across the window's end belong to the next window's logs.
+    """
+    if timestamp is None:
+        timestamp = datetime.datetime.now().isoformat()
+
+    def month(ride):
+        return by_month.setdefault((ride.start_date.year, ride.start_date.month),
+                                   {"rides": 0, "commutes": 0, "activities": []})
+
+    by_month = {}
+    in_window = set()
+    for r in rides:
+        month(r)["rides"] += 1
+        in_window.add(r.id)
+    for c in commutes:
+        month(c[0] if isinstance(c, list) else c)["commutes"] += 1
+        for r in (c if isinstance(c, list) else [c]):
+            if r.id in in_window:
+                month(r)["activities"].append(r)
+
+    logs = {}
+    for key, month_data in sorted(by_month.items()):
+        activities = month_data["activities"]
+        logs[key] = {
+            "analysis_timestamp": timestamp,
+            "home": home,
+            "work": work,
+            "commutes_count": month_data["commutes"],
+            "commute_activity_ids": [r.id for r in activities],
+            "statistics": {
+                "total_rides": month_data["rides"],
+                "total_commute_activities": len(activities),
+                "total_distance_km": sum([float(r.distance) for r in activities]) / 1000.0
+            }
+        }
+    return logs
+
+
+def analyze(rides, radius_meters=DEFAULT_RADIUS_METERS, max_time_gap_hours=DEFAULT_MAX_GAP_HOURS, home=None, work=None,
+            edge_rides=(), anchors=None, commute_pairs=None, exclude_detours=False, route_index=None):
+    """Estimate home/work (unless given) and detect commutes.
+
+    edge_rides are rides just outside the analysis window (see fetch_edge_rides). They
+    only complete chains crossing the window edges: a commute is kept when its first
+    ride is one of rides, so a chain is counted once, in the window it starts in.
+
+    anchors (extra named places) and commute_pairs (category pairs) are passed on to
+    CommuteDetector. With exclude_detours, single-ride commutes whose route is not one of
+    the usual routes are moved from 'commutes' to 'detours'. The usual routes come from
+    route_index (the athlete's, see athlete_route_index), else from these commutes alone.
+
+    Returns a dict with 'home', 'work', 'commutes' (empty if either location is unknown),
+    'detours' and 'anchors' (every anchor the commutes were detected with).
+    """
+    rides = RideTable.of(rides)
+    if home is None or work is None:
+        estimated_home, estimated_work = LocationAnalyzer().estimate_locations(rides)
+        home = home or estimated_home
+        work = work or estimated_work
+
+    commutes, detector_anchors = [], []
+    if home and work:
+        detector = CommuteDetector(home, work, radius_meters=radius_meters, max_time_gap_hours=max_time_gap_hours,
+                                   anchors=anchors, commute_pairs=commute_pairs)
+        detector_anchors = detector.anchors
+        if edge_rides:
+            ids = set(rides.ids.tolist())
+            commutes = [c for c in detector.detect_commutes(RideTable(rides.rides + list(edge_rides)))
+                        if (c[0] if isinstance(c, list) else c).id in ids]
+        else:
+            commutes = detector.detect_commutes(rides)
+    detours = []
+    if exclude_detours and commutes:
+        usual, detours = split_detours([c for c in commutes if not isinstance(c, list)], index=route_index)
+        detour_ids = {r.id for r in detours}
+        commutes = [c for c in commutes if isinstance(c, list) or c.id not in detour_ids]
+    return {'home': home, 'work': work, 'commutes': commutes, 'detours': detours, 'anchors': detector_anchors}
@@ -0,0 +1,148 @@
+import datetime
+import hashlib
+import numpy as np
+
+
+def _latlng(latlng):
+    """Parse a stravalib LatLon, list or tuple into (lat, lng) floats, or None."""
+    if latlng is None:
+        return None
+    try:
+        return float(latlng[0]), float(latlng[1])
+    except (TypeError, KeyError, IndexError):
+        lat = getattr(latlng, 'lat', None)
+        lon = getattr(latlng, 'lon', getattr(latlng, 'lng', None))
+        if lat is not None and lon is not None:
+            return float(lat), float(lon)
+    return None
+
+
+def _seconds(obj):
+    # elapsed_time might be a stravalib Duration object, timedelta, or float
+    if obj is None:
+        return 0.0
+    if hasattr(obj, 'total_seconds') and callable(obj.total_seconds):
+        return float(obj.total_seconds())
+    try:
+        return float(obj)
+    except (TypeError, ValueError):
+        # Some versions might have a 'seconds' attribute
+        return float(getattr(obj, 'seconds', 0))
+
+
+class Ride:
+    """Compact, immutable-by-convention record of the activity fields the analysis uses."""
+
+    __slots__ = ('id', 'name', 'type', 'start_date', 'elapsed_seconds', 'distance',
+                 'start_lat', 'start_lng', 'end_lat', 'end_lng', 'polyline')
+
+    def __init__(self, id, name, type, start_date, elapsed_seconds, distance,
+                 start_lat=None, start_lng=None, end_lat=None, end_lng=None, polyline=None):
+        self.id = id
+        self.name = name
+        self.type = type
+        self.start_date = start_date
+        self.elapsed_seconds = elapsed_seconds
+        self.distance = distance
+        self.start_lat = start_lat
+        self.start_lng = start_lng
+        self.end_lat = end_lat
+        self.end_lng = end_lng
+        self.polyline = polyline
+
+    @classmethod
+    def from_activity(cls, activity):
+        """Build a Ride from a stravalib activity model, doing all duck-typing once."""
+        start = _latlng(activity.start_latlng) or (None, None)
+        end = _latlng(activity.end_latlng) or (None, None)
+        activity_map = getattr(activity, 'map', None)
+        start_date = activity.start_date
+        if start_date.tzinfo is None:
+            start_date = start_date.replace(tzinfo=datetime.timezone.utc)
+        return cls(
+            id=int(activity.id),
+            name=activity.name or "",
+            type=str(getattr(activity.type, 'root', activity.type)),
+            start_date=start_date,
+            elapsed_seconds=_seconds(activity.elapsed_time),
+            distance=float(activity.distance or 0.0),
+            start_lat=start[0], start_lng=start[1],
+            end_lat=end[0], end_lng=end[1],
+            polyline=getattr(activity_map, 'summary_polyline', None) or None,
+        )
+
+    @property
+    def start_latlng(self):
+        return (self.start_lat, self.start_lng) if self.start_lat is not None else None
+
+    @property
+    def end_latlng(self):
+        return (self.end_lat, self.end_lng) if self.end_lat is not None else None
+
+    @property
+    def end_date(self):
+        return self.start_date + datetime.timedelta(seconds=self.elapsed_seconds)
+
+    def __repr__(self):
+        return f"Ride(id={self.id}, start_date={self.start_date.isoformat()}, name={self.name!r})"
+
+
+class RideTable:
+    """Column arrays over a list of rides, built once and shared by every analysis stage.
+
+    Iterating or indexing yields the underlying Ride records. Missing coordinates are NaN.
+    """
+
+    def __init__(self, rides):
+        self.rides = list(rides)
+        self._fingerprint = None
+        n = len(self.rides)
+        self.ids = np.fromiter((r.id for r in self.rides), dtype=np.int64, count=n)
+        self.start_ts = np.fromiter((r.start_date.timestamp() for r in self.rides), dtype=float, count=n)
+        self.elapsed = np.fromiter((r.elapsed_seconds for r in self.rides), dtype=float, count=n)
+        self.distance = np.fromiter((r.distance for r in self.rides), dtype=float, count=n)
+        self.start_coords = np.array(
+            [(r.start_lat, r.start_lng) if r.start_lat is not None else (np.nan, np.nan) for r in self.rides],
+            dtype=float,
+        ).reshape(n, 2)
+        self.end_coords = np.array(
+            [(r.end_lat, r.end_lng) if r.end_lat is not None else (np.nan, np.nan) for r in self.rides],
+            dtype=float,
+        ).reshape(n, 2)
+
+    @classmethod
+    def of(cls, rides):
+        """Return rides unchanged if already a RideTable, else build one."""
+        return rides if isinstance(rides, cls) else cls(rides)
+
+    def fingerprint(self):
+        """Stable digest of the ride set and the fields the analysis reads, for cache keys."""
+        if self._fingerprint is None:
+            digest = hashlib.blake2b(digest_size=16)
+            for column in (self.ids, self.start_ts, self.elapsed, self.distance, self.start_coords, self.end_coords):
+                digest.update(column.tobytes())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    @property
+    def end_ts(self):
+        return self.start_ts + self.elapsed
+
+    def take(self, indices):
+        """Rides at the given positions (index array or boolean mask)."""
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+        return [self.rides[i] for i in indices]
+
+    def __len__(self):
+        return len(self.rides)
+
+    def __iter__(self):
+        return iter(self.rides)
+
+    def __getitem__(self, i):
+        return self.rides[i]
+
+    def __bool__(self):
+        return bool(self.rides)
@@ -0,0 +1,221 @@
+import os
+import sqlite3
+import time
+from contextlib import closing
+import numpy as np
+from .location_analyzer import haversine_meters
+from .visualizations import METERS_PER_DEGREE_LAT, decode_polyline
+
+# Points per route fingerprint, evenly spaced along the track
+ROUTE_POINTS = 16
+# Routes are bucketed by the grid cells of their first and last fingerprint points
+ROUTE_CELL_METERS = 500
+# Mean distance between corresponding fingerprint points for two rides to share a route
+ROUTE_MATCH_METERS = 150
+# A route ridden at least this often is one of the usual routes
+USUAL_ROUTE_MIN_RIDES = 3
+
+INDEX_PATH = "data/route_indexes.db"
+
+
+def route_fingerprint(points, n=ROUTE_POINTS):
+    """Simplify an (N, 2) lat/lng track to n points evenly spaced by distance, or None if too short.
+
+    Tracks of any length and sampling density reduce to the same fixed-size array,
+    so two rides can be compared point by point.
+    """
+    points = np.asarray(points, dtype=float)
+    if len(points) < 2:
+        return None
+    steps = haversine_meters(points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1])
+    along = np.concatenate(([0.0], np.cumsum(steps)))
+    if along[-1] == 0:
+        return None
+    targets = np.linspace(0.0, along[-1], n)
+    return np.column_stack([np.interp(targets, along, points[:, 0]), np.interp(targets, along, points[:, 1])])
+
+
+def ride_fingerprint(ride):
+    """route_fingerprint of a ride's summary polyline, or None if it has no usable track."""
+    return route_fingerprint(decode_polyline(ride.polyline)) if ride.polyline else None
+
+
+def route_distances(fingerprint, candidates):
+    """Mean point-wise distance in meters from one (n, 2) fingerprint to each of (M, n, 2) candidates."""
+    meters = haversine_meters(fingerprint[None, :, 0], fingerprint[None, :, 1], candidates[:, :, 0], candidates[:, :, 1])
+    return meters.mean(axis=1)
+
+
+class RouteIndex:
+    """Index of distinct routes, each a representative fingerprint plus how often it was ridden.
+
+    A lookup only compares against routes starting and ending in the grid cells next
+    to the query's own, so its cost stays flat as the number of indexed rides grows.
+    Routes match in either direction (the ride home uses the same route as the ride in).
+    update() counts each ride id once, so an index can be kept and fed overlapping fetches.
+    """
+
+    def __init__(self, cell_meters=ROUTE_CELL_METERS, match_meters=ROUTE_MATCH_METERS):
+        self.cell_lat = cell_meters / METERS_PER_DEGREE_LAT
+        self.match_meters = match_meters
+        self.fingerprints = []
+        self.counts = []
+        self.ride_ids = set()
+        self._buckets = {}
+
+    def _cell(self, latlng):
+        lat_cell = int(np.floor(latlng[0] / self.cell_lat))
+        cell_lng = self.cell_lat / max(np.cos(np.radians((lat_cell + 0.5) * self.cell_lat)), 0.01)
+        return lat_cell, int(np.floor(latlng[1] / cell_lng))
+
+    def _candidates(self, fingerprint):
+        start, end = self._cell(fingerprint[0]), self._cell(fingerprint[-1])
+        ids = []
+        for dy1 in (-1, 0, 1):
+            for dx1 in (-1, 0, 1):
+                for dy2 in (-1, 0, 1):
+                    for dx2 in (-1, 0, 1):
+                        key = (start[0] + dy1, start[1] + dx1, end[0] + dy2, end[1] + dx2)
+                        ids.extend(self._buckets.get(key, ()))
+        return ids
+
+    def find(self, fingerprint):
+        """(route id, mean distance in meters) of the closest indexed route within match_meters, else (-1, inf)."""
+        best_id, best_meters = -1, np.inf
+        for fp in (fingerprint, fingerprint[::-1]):
+            ids = self._candidates(fp)
+            if not ids:
+                continue
+            meters = route_distances(fp, np.stack([self.fingerprints[i] for i in ids]))
+            i = int(np.argmin(meters))
+            if meters[i] < best_meters:
+                best_id, best_meters = ids[i], float(meters[i])
+        if best_meters > self.match_meters:
+            return -1, np.inf
+        return best_id, best_meters
+
+    def add(self, fingerprint):
+        """Count a ride of this route, indexing it as a new route if none matches; returns the route id."""
+        route_id, _ = self.find(fingerprint)
+        if route_id != -1:
+            self.counts[route_id] += 1
+            return route_id
+        return self._append(fingerprint, 1)
+
+    def _append(self, fingerprint, count):
+        route_id = len(self.fingerprints)
+        self.fingerprints.append(fingerprint)
+        self.counts.append(count)
+        start, end = self._cell(fingerprint[0]), self._cell(fingerprint[-1])
+        self._buckets.setdefault(start + end, []).append(route_id)
+        return route_id
+
+    def add_ride(self, ride):
+        """add() for a ride's summary polyline; -1 if it has no usable track."""
+        fingerprint = ride_fingerprint(ride)
+        return -1 if fingerprint is None else self.add(fingerprint)
+
+    def update(self, rides):
+        """add_ride() for each ride not indexed before; returns how many were new."""
+        new = 0
+        for ride in rides:
+            if ride.id not in self.ride_ids:
+                self.ride_ids.add(ride.id)
+                self.add_ride(ride)
+                new += 1
+        return new
+
+    def is_usual(self, route_id, min_rides=USUAL_ROUTE_MIN_RIDES):
+        return route_id != -1 and self.counts[route_id] >= min_rides
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+
+def split_detours(rides, min_rides=USUAL_ROUTE_MIN_RIDES, index=None):
+    """Split rides into (on a usual route or without a track, detours).
+
+    The usual routes come from index (e.g. athlete_route_index, which must already hold
+    the rides); without one, they are indexed from the given rides alone.
+    """
+    fingerprints = [ride_fingerprint(r) for r in rides]
+    if index is None:
+        index = RouteIndex()
+        route_ids = [-1 if fp is None else index.add(fp) for fp in fingerprints]
+    else:
+        route_ids = [-1 if fp is None else index.find(fp)[0] for fp in fingerprints]
+    usual, detours = [], []
+    for ride, fingerprint, route_id in zip(rides, fingerprints, route_ids):
+        if fingerprint is None or index.is_usual(route_id, min_rides):
+            usual.append(ride)
+        else:
+            detours.append(ride)
+    return usual, detours
+
+
+class RouteIndexStore:
+    """SQLite persistence of one RouteIndex per athlete."""
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS route_indexes (
+                    athlete_id INTEGER PRIMARY KEY,
+                    fingerprints BLOB NOT NULL,
+                    counts BLOB NOT NULL,
+                    ride_ids BLOB NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, athlete_id):
+        """The athlete's stored index, or None."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT fingerprints, counts, ride_ids FROM route_indexes WHERE athlete_id = ?", (athlete_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        fingerprints, counts, ride_ids = row
+        index = RouteIndex()
+        for fingerprint, count in zip(np.frombuffer(fingerprints, dtype=float).reshape(-1, ROUTE_POINTS, 2),
+                                      np.frombuffer(counts, dtype=np.int64).tolist()):
+            index._append(fingerprint, count)
+        index.ride_ids = set(np.frombuffer(ride_ids, dtype=np.int64).tolist())
+        return index
+
+    def put(self, athlete_id, index):
+        fingerprints = np.array(index.fingerprints, dtype=float).reshape(-1, ROUTE_POINTS, 2)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO route_indexes VALUES (?, ?, ?, ?, ?)",
+                (athlete_id, fingerprints.tobytes(), np.array(index.counts, dtype=np.int64).tobytes(),
+                 np.array(sorted(index.ride_ids), dtype=np.int64).tobytes(), time.time()),
+            )
+
+    def delete(self, athlete_id):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM route_indexes WHERE athlete_id = ?", (athlete_id,))
+
+
+def athlete_route_index(athlete_id, activity_store, rides=(), index_store=None):
+    """The athlete's persisted route index with rides folded in.
+
+    The first call indexes every ride in activity_store for the athlete; later calls
+    only add rides not indexed yet.
+    """
+    index_store = index_store or RouteIndexStore()
+    index = index_store.get(athlete_id)
+    if index is None:
+        index = RouteIndex()
+        rides = list(activity_store.get_activities(athlete_id, 0, float('inf'), activity_type='Ride')) + list(rides)
+    if index.update(rides):
+        index_store.put(athlete_id, index)
+    return index
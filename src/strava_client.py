@@ -1,25 +1,135 @@
 import datetime
-import streamlit as st
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from .auth import StravaAuth
+from .activity_store import ActivityStore
+from .rides import Ride
+from .instrumentation import instrumentation
+from .edit_scheduler import EditJournal, EditScheduler, call_with_retries, journal_path, shared_rate_limiter
+
+# Concurrent month chunks fetched by fetch_rides_range
+FETCH_WORKERS = 4
+# The athlete profile is re-fetched after this long (app and auth pages show it on every rerun)
+ATHLETE_TTL_SECONDS = 600
+# Rides this close outside an analysis window are fetched so chains can cross its edges
+EDGE_OVERLAP_HOURS = 24
+# Activities per page yielded by stream_rides_range; stravalib's default per_page, so one request each
+STREAM_PAGE_SIZE = 200
+# Retries of a throttled (429), unauthorized (401) or failed (5xx) page request, and the base backoff
+READ_RETRIES = 5
+READ_BACKOFF_SECONDS = 2.0
+
+# Ends a month's page queue in stream_rides_range
+_MONTH_DONE = object()
+
+
+def _as_utc(dt):
+    """Treat naive datetimes as UTC, like stravalib does."""
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.astimezone(datetime.timezone.utc)
+
+
+def month_bounds(year, month):
+    """UTC [start, end) datetimes of a calendar month."""
+    after = datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc)
+    if month == 12:
+        before = datetime.datetime(year + 1, 1, 1, tzinfo=datetime.timezone.utc)
+    else:
+        before = datetime.datetime(year, month + 1, 1, tzinfo=datetime.timezone.utc)
+    return after, before
+
+
+def month_chunks(after, before):
+    """Whole calendar months (as [start, end) pairs) covering the window [after, before)."""
+    chunks = []
+    year, month = after.year, after.month
+    while True:
+        start, end = month_bounds(year, month)
+        if start >= before:
+            break
+        chunks.append((start, end))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return chunks
+
+
+def edge_windows(after, before, overlap_hours=EDGE_OVERLAP_HOURS):
+    """The [start, end) windows just before and just after [after, before), skipping the future."""
+    overlap = datetime.timedelta(hours=overlap_hours)
+    after, before = _as_utc(after), _as_utc(before)
+    windows = [(after - overlap, after)]
+    if before < datetime.datetime.now(datetime.timezone.utc):
+        windows.append((before, before + overlap))
+    return windows
+
+
+def _pages(activities, size, rate_limiter, max_retries=READ_RETRIES, backoff_seconds=READ_BACKOFF_SECONDS):
+    """Split an activity iterator into lists of up to size items, timing each page fetch.
+
+    size matches stravalib's per_page, so each page is one request: it waits for the rate
+    limiter and is retried with backoff like an edit. stravalib re-requests the same page
+    after an error, and items read before it are kept. Stops at the first short page:
+    stravalib's iterator resets itself once exhausted, so reading past its end would start
+    again from the first page.
+    """
+    activities = iter(activities)
+    while True:
+        page = []
+
+        def fill():
+            page.extend(itertools.islice(activities, size - len(page)))
+
+        with instrumentation.span('fetch.page'):
+            call_with_retries(fill, rate_limiter, max_retries, backoff_seconds)
+        if page:
+            yield page
+        if len(page) < size:
+            return
 
 
 class StravaClient:
-    """Strava API client wrapper with session-aware authentication."""
+    """Strava API client wrapper with session-aware (or token-file) authentication."""
     
-    def __init__(self):
+    def __init__(self, store=None, token_store=None, rate_limiter=None, backoff_seconds=READ_BACKOFF_SECONDS,
+                 http_session=None):
         self._auth = None
+        self._token_store = token_store
+        self._http_session = http_session
+        self._store = store
+        # Reads and edits share the process-wide limiter unless one is given (e.g. for a mock server)
+        self.rate_limiter = rate_limiter or shared_rate_limiter()
+        self.backoff_seconds = backoff_seconds
+        self._athlete_id = None
+        self._athlete = None
+        self._athlete_fetched_at = 0.0
     
     @property
     def auth(self):
         """Lazy-load auth to ensure session state is available."""
         if self._auth is None:
-            self._auth = StravaAuth()
+            self._auth = StravaAuth(token_store=self._token_store, http_session=self._http_session)
         return self._auth
     
     @property
     def client(self):
-        """Get the authenticated Strava client."""
-        return self.auth.get_client()
+        """Get the authenticated Strava client, its responses observed by the rate limiter."""
+        client = self.auth.get_client()
+        if client is not None:
+            self.rate_limiter.attach(client.protocol.rsession)
+        return client
+
+    def _pages(self, activities):
+        return _pages(activities, STREAM_PAGE_SIZE, self.rate_limiter, backoff_seconds=self.backoff_seconds)
+
+    @property
+    def store(self):
+        """Lazy-load the local activity store."""
+        if self._store is None:
+            self._store = ActivityStore()
+        return self._store
 
     def is_authenticated(self):
         return self.auth.is_authenticated()
@@ -28,31 +138,169 @@ class StravaClient:
         """Disconnect the user by clearing their tokens."""
         self.auth.clear_tokens()
         self._auth = None  # Reset auth instance
+        self._athlete_id = None
+        self._athlete = None
 
     def fetch_rides(self, year, month):
-        if not self.client:
+        """Return the month's rides, syncing only activities newer than the local store has."""
+        after, before = month_bounds(year, month)
+        return self.fetch_rides_range(after, before)
+
+    @instrumentation.timed('fetch')
+    def fetch_rides_range(self, after, before, max_workers=FETCH_WORKERS):
+        """Return Ride records with after <= start_date < before, fetched as concurrent month chunks.
+
+        Chunks are whole calendar months so each one reuses the store's month sync state;
+        results are merged, de-duplicated by activity id and sorted oldest first.
+        """
+        client = self.client
+        if not client:
+            return []
+        athlete_id = self.get_athlete_id()
+
+        after, before = _as_utc(after), _as_utc(before)
+        chunks = month_chunks(after, before)
+        if not chunks:
+            return []
+
+        rides = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as pool:
+            results = pool.map(lambda chunk: self._fetch_window(client, athlete_id, *chunk), chunks)
+            for chunk_rides in results:
+                for ride in chunk_rides:
+                    if after <= ride.start_date < before:
+                        rides.setdefault(ride.id, ride)
+        return sorted(rides.values(), key=lambda a: a.start_date)
+
+    def fetch_edge_rides(self, after, before, overlap_hours=EDGE_OVERLAP_HOURS):
+        """Rides within overlap_hours outside [after, before), used to complete chains crossing its edges."""
+        client = self.client
+        if not client:
             return []
+        athlete_id = self.get_athlete_id()
+        rides = []
+        for start, end in edge_windows(after, before, overlap_hours):
+            rides.extend(r for r in self._fetch_window(client, athlete_id, start, end) if start <= r.start_date < end)
+        return sorted(rides, key=lambda a: a.start_date)
 
-        # Calculate after and before timestamps
-        after = datetime.datetime(year, month, 1)
-        if month == 12:
-            before = datetime.datetime(year + 1, 1, 1)
+    def stream_rides_range(self, after, before, progress_callback=None, max_workers=FETCH_WORKERS):
+        """Yield lists of Ride records with after <= start_date < before as each page arrives.
+
+        Up to max_workers months are fetched concurrently, as in fetch_rides_range, but pages
+        are yielded oldest month first, so the first page is available after a single request
+        however long the window is. Each page is written to the store before it is yielded.
+        progress_callback(rides_so_far, months_done, months_total) is called after every page.
+        Closing or abandoning the generator (as a Streamlit rerun does) stops the workers after
+        their current page, and a month is only marked synced once fully read.
+        """
+        client = self.client
+        if not client:
+            return
+        athlete_id = self.get_athlete_id()
+
+        after, before = _as_utc(after), _as_utc(before)
+        chunks = month_chunks(after, before)
+        if not chunks:
+            return
+        # One queue of pages per month, ended by _MONTH_DONE (or an exception raised by its worker)
+        months = [queue.Queue() for _ in chunks]
+        stopped = threading.Event()
+
+        def read_month(i, start, end):
+            try:
+                for page in self._stream_window(client, athlete_id, start, end):
+                    if stopped.is_set():
+                        return
+                    months[i].put(page)
+            except Exception as e:
+                months[i].put(e)
+            finally:
+                months[i].put(_MONTH_DONE)
+
+        pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks))))
+        try:
+            for i, (start, end) in enumerate(chunks):
+                pool.submit(read_month, i, start, end)
+            seen = set()
+            total = 0
+            for done, pages in enumerate(months):
+                for page in iter(pages.get, _MONTH_DONE):
+                    if isinstance(page, Exception):
+                        raise page
+                    page = [r for r in page if after <= r.start_date < before and r.id not in seen]
+                    seen.update(r.id for r in page)
+                    total += len(page)
+                    if page:
+                        yield page
+                    if progress_callback:
+                        progress_callback(total, done, len(chunks))
+                if progress_callback:
+                    progress_callback(total, done + 1, len(chunks))
+        finally:
+            stopped.set()
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _stream_window(self, client, athlete_id, after, before):
+        """Pages of rides in one chunk: stored rides first, then any newer API pages."""
+        if athlete_id is None:
+            for page in self._pages(client.get_activities(after=after, before=before)):
+                yield [Ride.from_activity(a) for a in page if a.type == 'Ride']
+            return
+
+        after_ts, before_ts = int(after.timestamp()), int(before.timestamp())
+        if self.store.is_complete(athlete_id, after_ts, before_ts):
+            instrumentation.count('fetch.store_hits')
+            yield self.store.get_activities(athlete_id, after_ts, before_ts, activity_type='Ride')
+            return
+
+        instrumentation.count('fetch.store_misses')
+        cursor = self.store.resume_from(athlete_id, after_ts, before_ts)
+        if cursor > after_ts:
+            # Part of the month settled before the last sync; the rest is requested again
+            yield self.store.get_activities(athlete_id, after_ts, cursor + 1, activity_type='Ride')
+
+        synced_at = int(time.time())
+        activities = client.get_activities(
+            after=datetime.datetime.fromtimestamp(cursor, datetime.timezone.utc), before=before
+        )
+        for page in self._pages(activities):
+            instrumentation.count('fetch.pages')
+            rides = [Ride.from_activity(a) for a in page]
+            self.store.upsert_activities(athlete_id, rides)
+            yield [r for r in rides if r.type == 'Ride']
+        self.store.mark_synced(athlete_id, after_ts, before_ts, synced_at)
+
+    def _fetch_window(self, client, athlete_id, after, before):
+        """Rides in one chunk, served from the local store when it is already synced."""
+        if athlete_id is None:
+            # Read every page here, in the worker thread, so chunks are fetched concurrently
+            activities = client.get_activities(after=after, before=before)
+            return [Ride.from_activity(a) for page in self._pages(activities) for a in page if a.type == 'Ride']
+
+        after_ts, before_ts = int(after.timestamp()), int(before.timestamp())
+        if self.store.is_complete(athlete_id, after_ts, before_ts):
+            instrumentation.count('fetch.store_hits')
         else:
-            before = datetime.datetime(year, month + 1, 1)
+            instrumentation.count('fetch.store_misses')
+            cursor = self.store.resume_from(athlete_id, after_ts, before_ts)
+            synced_at = int(time.time())
+            with instrumentation.span('fetch.api', month=after.strftime("%Y-%m")):
+                activities = client.get_activities(
+                    after=datetime.datetime.fromtimestamp(cursor, datetime.timezone.utc), before=before
+                )
+                self.store.upsert_activities(
+                    athlete_id, (Ride.from_activity(a) for page in self._pages(activities) for a in page)
+                )
+            self.store.mark_synced(athlete_id, after_ts, before_ts, synced_at)
 
-        activities = self.client.get_activities(after=after, before=before)
-        rides = [a for a in activities if a.type == 'Ride']
-        return rides
+        return self.store.get_activities(athlete_id, after_ts, before_ts, activity_type='Ride')
 
     def update_activity(self, activity_id, commute=None, trainer=None, hide_from_home=None, visibility=None):
         if not self.client:
             return False
         
-        update_params = {}
-        if commute is not None: update_params['commute'] = commute
-        if trainer is not None: update_params['trainer'] = trainer
-        if hide_from_home is not None: update_params['hide_from_home'] = hide_from_home
-        
+        update_params = self.build_update_params(commute=commute, trainer=trainer, hide_from_home=hide_from_home)
+
         try:
             self.client.update_activity(activity_id, **update_params)
             return True
@@ -60,7 +308,42 @@ class StravaClient:
             print(f"Error updating activity {activity_id}: {e}")
             return False
 
-    def get_athlete(self):
+    @staticmethod
+    def build_update_params(commute=None, trainer=None, hide_from_home=None):
+        """Keyword arguments for stravalib's update_activity, leaving out unset fields."""
+        update_params = {}
+        if commute is not None: update_params['commute'] = commute
+        if trainer is not None: update_params['trainer'] = trainer
+        if hide_from_home is not None: update_params['hide_from_home'] = hide_from_home
+        return update_params
+
+    def create_edit_scheduler(self, journal_name, update_params, **kwargs):
+        """EditScheduler bound to the authenticated client, journaled under journal_name."""
         if not self.client:
             return None
-        return self.client.get_athlete()
+        # Journals are kept per athlete so concurrent users never share one
+        athlete_id = self.get_athlete_id()
+        if athlete_id is not None:
+            journal_name = f"{athlete_id}/{journal_name}"
+        journal = EditJournal(journal_path(journal_name, update_params))
+        rate_limiter = kwargs.pop('rate_limiter', None) or self.rate_limiter
+        rate_limiter.attach(self.client.protocol.rsession)
+        return EditScheduler(self.client, journal, rate_limiter=rate_limiter, get_client=self.auth.get_client, **kwargs)
+
+    def get_athlete(self, max_age=ATHLETE_TTL_SECONDS):
+        """The connected athlete's profile, cached for max_age seconds."""
+        if self._athlete is not None and time.time() - self._athlete_fetched_at < max_age:
+            return self._athlete
+        client = self.client
+        if not client:
+            return None
+        self._athlete = call_with_retries(client.get_athlete, self.rate_limiter, READ_RETRIES, self.backoff_seconds)
+        self._athlete_fetched_at = time.time()
+        return self._athlete
+
+    def get_athlete_id(self):
+        """Athlete id of the connected user, cached to key the local store."""
+        if self._athlete_id is None:
+            athlete = self.get_athlete()
+            self._athlete_id = athlete.id if athlete else None
+        return self._athlete_id
@@ -0,0 +1,121 @@
+import datetime
+import math
+import random
+
+import polyline
+
+from .rides import Ride
+
+DEFAULT_HOME = (47.4979, 19.0402)
+DEFAULT_WORK = (47.5136, 19.0810)
+
+
+def _offset(point, rng, spread_meters):
+    """Point jittered by a normal offset with the given standard deviation in meters."""
+    lat, lng = point
+    dlat = rng.gauss(0, spread_meters) / 111320.0
+    dlng = rng.gauss(0, spread_meters) / (111320.0 * math.cos(math.radians(lat)))
+    return lat + dlat, lng + dlng
+
+
+def _distance_meters(a, b):
+    dlat = (b[0] - a[0]) * 111320.0
+    dlng = (b[1] - a[1]) * 111320.0 * math.cos(math.radians(a[0]))
+    return math.hypot(dlat, dlng)
+
+
+def _track(start, end, rng, points=20, wobble_meters=40):
+    """Wobbly straight-line track between two points."""
+    track = []
+    for i in range(points):
+        t = i / (points - 1)
+        p = (start[0] + (end[0] - start[0]) * t, start[1] + (end[1] - start[1]) * t)
+        track.append(p if i in (0, points - 1) else _offset(p, rng, wobble_meters))
+    return track
+
+
+class SyntheticRideGenerator:
+    """Builds realistic fake rides for benchmarks and offline tests.
+
+    Weekdays get a home -> work and a work -> home commute; a share of those are split
+    into two-leg chains with a coffee stop. Noise rides are training loops from home or
+    one-way trips between home and a random place in the wider area.
+    """
+
+    def __init__(self, seed=0, home=DEFAULT_HOME, work=DEFAULT_WORK, start=datetime.datetime(2020, 1, 1),
+                 spread_meters=40, chain_fraction=0.15, noise_fraction=0.25, with_polylines=True):
+        self.rng = random.Random(seed)
+        self.home = home
+        self.work = work
+        self.start = start.replace(tzinfo=datetime.timezone.utc) if start.tzinfo is None else start
+        self.spread_meters = spread_meters
+        self.chain_fraction = chain_fraction
+        self.noise_fraction = noise_fraction
+        self.with_polylines = with_polylines
+        self._next_id = 1
+
+    def _ride(self, start_date, start, end, name, speed_mps=5.5):
+        distance = _distance_meters(start, end) * self.rng.uniform(1.15, 1.35)
+        ride = Ride(
+            id=self._next_id,
+            name=name,
+            type='Ride',
+            start_date=start_date,
+            elapsed_seconds=round(distance / speed_mps + self.rng.uniform(60, 300)),
+            distance=round(distance, 1),
+            start_lat=start[0], start_lng=start[1],
+            end_lat=end[0], end_lng=end[1],
+            polyline=polyline.encode(_track(start, end, self.rng)) if self.with_polylines else None,
+        )
+        self._next_id += 1
+        return ride
+
+    def _commute(self, start_date, origin, destination, name):
+        start = _offset(origin, self.rng, self.spread_meters)
+        end = _offset(destination, self.rng, self.spread_meters)
+        if self.rng.random() >= self.chain_fraction:
+            return [self._ride(start_date, start, end, name)]
+
+        # Coffee stop roughly halfway, with a short break between the legs
+        stop = _offset(((start[0] + end[0]) / 2, (start[1] + end[1]) / 2), self.rng, 300)
+        first = self._ride(start_date, start, stop, f"{name} (to coffee)")
+        resume = first.end_date + datetime.timedelta(minutes=self.rng.uniform(10, 60))
+        second = self._ride(resume, _offset(stop, self.rng, 15), end, f"{name} (from coffee)")
+        return [first, second]
+
+    def _noise(self, day):
+        start_date = day + datetime.timedelta(hours=self.rng.uniform(9, 20))
+        if self.rng.random() < 0.6:
+            # Training loop from home
+            start = _offset(self.home, self.rng, self.spread_meters)
+            end = _offset(self.home, self.rng, self.spread_meters)
+        else:
+            # Errand or one-way trip somewhere in the wider area
+            start = _offset(self.home, self.rng, self.spread_meters)
+            end = _offset(self.home, self.rng, 10000)
+            if self.rng.random() < 0.5:
+                start, end = end, start
+        return [self._ride(start_date, start, end, "Afternoon Ride", speed_mps=6.5)]
+
+    def generate(self, n):
+        """Generate exactly n rides in chronological order."""
+        rides = []
+        day = self.start
+        while len(rides) < n:
+            if day.weekday() < 5:
+                morning = day + datetime.timedelta(hours=self.rng.uniform(7, 9))
+                evening = day + datetime.timedelta(hours=self.rng.uniform(16.5, 18.5))
+                day_rides = self._commute(morning, self.home, self.work, "Morning Ride")
+                day_rides += self._commute(evening, self.work, self.home, "Evening Ride")
+                if self.rng.random() < self.noise_fraction:
+                    day_rides += self._noise(day)
+                rides.extend(sorted(day_rides, key=lambda r: r.start_date))
+            elif self.rng.random() < 2 * self.noise_fraction:
+                rides.extend(self._noise(day))
+            day += datetime.timedelta(days=1)
+        return rides[:n]
+
+
+def generate_rides(n, seed=0, **kwargs):
+    """Shortcut for SyntheticRideGenerator(seed, **kwargs).generate(n)."""
+    return SyntheticRideGenerator(seed=seed, **kwargs).generate(n)
@@ -1,52 +1,174 @@
-import plotly.express as px
-import pandas as pd
-import folium
-from folium.plugins import HeatMap
-import polyline
+import numpy as np
+from functools import lru_cache
+from .instrumentation import instrumentation
+from .rides import RideTable
 
-def create_commute_heatmap(commutes):
+# Heatmap points are aggregated into square cells of this size before rendering
+HEATMAP_CELL_METERS = 50
+METERS_PER_DEGREE_LAT = 111320.0
+
+# Above this many start/end points the overview map merges nearby points into grid cells
+OVERVIEW_MAX_POINTS = 2000
+OVERVIEW_CELL_METERS = 25
+OVERVIEW_COLORS = {'start': 'green', 'end': 'orange'}
+
+
+@lru_cache(maxsize=4096)
+def decode_polyline(encoded):
+    """Decode a Google encoded polyline into a read-only (N, 2) array of lat/lng degrees.
+
+    Vectorized over the whole string and cached by polyline, so reruns skip decoding.
+    """
+    if not encoded:
+        return np.empty((0, 2))
+    chunks = np.frombuffer(encoded.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    is_last = chunks < 0x20
+    ends = np.flatnonzero(is_last)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    # Shift each 5-bit chunk by its position within its varint, then sum per varint
+    position = np.arange(len(chunks)) - np.repeat(starts, ends - starts + 1)
+    values = np.add.reduceat((chunks & 0x1f) << (5 * position), starts)
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+    coords = np.cumsum(deltas[:len(deltas) // 2 * 2].reshape(-1, 2), axis=0) / 1e5
+    coords.setflags(write=False)
+    return coords
+
+
+def grid_cells(points, cell_meters):
+    """Snap (N, 2) lat/lng points to square grid cells; returns (cell centers, point counts)."""
+    cell_lat = cell_meters / METERS_PER_DEGREE_LAT
+    cell_lng = cell_lat / max(np.cos(np.radians(np.mean(points[:, 0]))), 0.01)
+    cells = np.floor(points / (cell_lat, cell_lng)).astype(np.int64)
+    unique_cells, counts = np.unique(cells, axis=0, return_counts=True)
+    return (unique_cells + 0.5) * (cell_lat, cell_lng), counts
+
+
+def grid_bin_points(points, cell_meters=HEATMAP_CELL_METERS):
+    """Aggregate (N, 2) lat/lng points into [lat, lng, weight] rows, one per occupied grid cell.
+
+    Weights are point counts normalized to a maximum of 1.
+    """
+    if len(points) == 0:
+        return np.empty((0, 3))
+    centers, counts = grid_cells(points, cell_meters)
+    return np.column_stack([centers, counts / counts.max()])
+
+
+def downsample_points(points, max_points=OVERVIEW_MAX_POINTS, cell_meters=OVERVIEW_CELL_METERS):
+    """Reduce (N, 2) lat/lng points to at most max_points grid cell centers.
+
+    Points are returned unchanged (with count 1) when under the limit; otherwise the
+    grid cell size doubles until few enough cells are occupied. Returns (points, counts).
+    """
+    points = points[~np.isnan(points).any(axis=1)]
+    if len(points) <= max_points:
+        return points, np.ones(len(points), dtype=np.int64)
+    while True:
+        centers, counts = grid_cells(points, cell_meters)
+        if len(centers) <= max_points:
+            return centers, counts
+        cell_meters *= 2
+
+
+def overview_geojson(rides, max_points=OVERVIEW_MAX_POINTS):
+    """GeoJSON FeatureCollection of ride start and end points, downsampled above max_points.
+
+    Each feature carries 'kind' ('start' or 'end') and 'count' (rides merged into it).
+    """
+    rides = RideTable.of(rides)
+    features = []
+    # Split the budget between starts and ends so neither kind crowds out the other
+    for kind, coords in (('start', rides.start_coords), ('end', rides.end_coords)):
+        points, counts = downsample_points(coords, max_points // 2)
+        for (lat, lng), count in zip(np.round(points, 5).tolist(), counts.tolist()):
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [lng, lat]},
+                "properties": {"kind": kind, "count": count},
+            })
+    return {"type": "FeatureCollection", "features": features}
+
+
+@instrumentation.timed('render.overview_map')
+def create_overview_map(rides, home=None, work=None, max_points=OVERVIEW_MAX_POINTS, anchors=()):
+    """Map of home/work, extra anchors (with their radii) plus all ride starts (green) and ends (orange) as a single GeoJSON layer.
+
+    Payload size stays bounded for long histories: above max_points nearby points are
+    merged into grid cells, and merged cells are drawn larger.
+    """
+    import folium
+
+    m = folium.Map(location=home if home else [0,0], zoom_start=13)
+    if home:
+        folium.Marker(home, tooltip="Home", icon=folium.Icon(color='blue', icon='home')).add_to(m)
+    if work:
+        folium.Marker(work, tooltip="Work", icon=folium.Icon(color='red', icon='briefcase')).add_to(m)
+    for anchor in anchors:
+        folium.Marker(anchor.latlng, tooltip=f"{anchor.name} ({anchor.category})",
+                      icon=folium.Icon(color='purple', icon='flag')).add_to(m)
+        folium.Circle(anchor.latlng, radius=anchor.radius_meters, color='purple', fill=False).add_to(m)
+
+    data = overview_geojson(rides, max_points)
+    if data["features"]:
+        folium.GeoJson(
+            data,
+            name="Ride starts/ends",
+            marker=folium.CircleMarker(radius=3, fill=True),
+            style_function=lambda f: {
+                'color': OVERVIEW_COLORS[f['properties']['kind']],
+                'fillColor': OVERVIEW_COLORS[f['properties']['kind']],
+                'radius': 3 if f['properties']['count'] == 1 else 5,
+            },
+            tooltip=folium.GeoJsonTooltip(fields=['kind', 'count'], aliases=['Point', 'Rides']),
+        ).add_to(m)
+    return m
+
+
+@instrumentation.timed('render.heatmap')
+def create_commute_heatmap(commutes, cell_meters=HEATMAP_CELL_METERS):
     # Center map on first commute if available
     first_point = [0, 0]
-    points = []
+    tracks = []
     
     for c in commutes:
-        if isinstance(c, list):
-            for r in c:
-                if r.map.summary_polyline:
-                    decoded = polyline.decode(r.map.summary_polyline)
-                    points.extend(decoded)
-        else:
-            if c.map.summary_polyline:
-                decoded = polyline.decode(c.map.summary_polyline)
-                points.extend(decoded)
+        for r in (c if isinstance(c, list) else [c]):
+            if r.polyline:
+                tracks.append(decode_polyline(r.polyline))
     
-    if points:
-        first_point = points[0]
+    points = np.concatenate(tracks) if tracks else np.empty((0, 2))
+    if len(points):
+        first_point = points[0].tolist()
         
+    import folium
+    from folium.plugins import HeatMap
+
     m = folium.Map(location=first_point, zoom_start=12)
-    HeatMap(points).add_to(m)
+    HeatMap(grid_bin_points(points, cell_meters).tolist()).add_to(m)
     return m
 
-def plot_commute_stats(df):
-    if df.empty:
+def plot_commute_stats(rollups, period=None):
+    """Bar chart of commute distance per week, month or year from commute_rollups()."""
+    if rollups is None or rollups['daily'].empty:
         return None
-    
-    # Example: Distance over time
-    df['Date'] = pd.to_datetime(df['Date'])
-    fig = px.bar(df, x='Date', y='Distance (km)', title='Commute Distances', labels={'Distance (km)': 'Distance (km)'})
-    fig.update_layout(xaxis_title="Date", yaxis_title="Distance (km)")
+
+    import plotly.express as px
+    from .frames import chart_period
+
+    period = period or chart_period(rollups)
+    unit = {'weekly': 'Week', 'monthly': 'Month', 'yearly': 'Year'}[period]
+    data = rollups[period].reset_index()
+    fig = px.bar(data, x='Date', y='Distance (km)', hover_data=['Commutes'], title=f'Commute Distance per {unit}')
+    fig.update_layout(xaxis_title=unit, yaxis_title="Distance (km)")
     return fig
 
-def plot_day_distribution(df):
-    if df.empty:
+def plot_day_distribution(rollups):
+    """Pie chart of commutes per weekday from commute_rollups()."""
+    if rollups is None or rollups['daily'].empty:
         return None
-    
-    df['Date'] = pd.to_datetime(df['Date'])
-    df['Day'] = df['Date'].dt.day_name()
-    day_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    
-    counts = df['Day'].value_counts().reindex(day_order).fillna(0).reset_index()
-    counts.columns = ['Day', 'Count']
-    
-    fig = px.pie(counts, values='Count', names='Day', title='Commute Distribution by Day')
+    import plotly.express as px
+    from .frames import WEEKDAYS
+
+    counts = rollups['weekday'].reset_index()
+    fig = px.pie(counts, values='Commutes', names='Weekday', title='Commute Distribution by Day',
+                 category_orders={'Weekday': WEEKDAYS})
     return fig
@@ -0,0 +1,250 @@
+"""Strava webhook receiver that keeps the local activity store up to date.
+
+Strava validates a subscription with a GET handshake (hub.mode, hub.verify_token,
+hub.challenge) and then POSTs one small JSON event per change:
+
+    {"object_type": "activity", "object_id": 123, "aspect_type": "create",
+     "owner_id": 42, "updates": {}, "event_time": 1700000000, "subscription_id": 1}
+
+Events are acknowledged immediately and applied by a background worker: deletes and
+title/type updates are applied locally, creates fetch the activity with the owner's
+tokens, and an athlete deauthorization drops everything cached for them.
+"""
+import json
+import os
+import queue
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .activity_store import ActivityStore, SYNC_GRACE_SECONDS
+from .auth import FileTokenStore, StravaAuth
+from .instrumentation import instrumentation
+from .rides import Ride
+
+# Per-athlete token files used to fetch created activities (written by `cli login --token-file`)
+WEBHOOK_TOKEN_DIR = "data/tokens"
+DEFAULT_PORT = 8080
+# How often a running receiver refreshes its marker in the store (see WEBHOOK_MAX_AGE_SECONDS)
+HEARTBEAT_SECONDS = 60
+
+ASPECT_TYPES = ('create', 'update', 'delete')
+OBJECT_TYPES = ('activity', 'athlete')
+
+
+def token_file_for(athlete_id):
+    return os.path.join(WEBHOOK_TOKEN_DIR, f"{athlete_id}.json")
+
+
+def fetch_with_token_files(owner_id, activity_id, fallback_token_file=None):
+    """Fetch an activity as a Ride using the owner's token file; None without usable tokens."""
+    for path in (token_file_for(owner_id), fallback_token_file):
+        if path and os.path.exists(path):
+            client = StravaAuth(token_store=FileTokenStore(path)).get_client()
+            if client:
+                return Ride.from_activity(client.get_activity(activity_id))
+    return None
+
+
+class WebhookProcessor:
+    """Validates the subscription handshake and applies push events to an ActivityStore.
+
+    fetch_activity(owner_id, activity_id) returns a Ride (or None when the owner's
+    tokens are not available); it is only called for activities not already cached.
+    """
+
+    def __init__(self, store=None, verify_token=None, fetch_activity=None):
+        self.store = store or ActivityStore()
+        self.verify_token = verify_token or os.getenv("STRAVA_WEBHOOK_VERIFY_TOKEN")
+        self.fetch_activity = fetch_activity or fetch_with_token_files
+
+    def verify(self, params):
+        """(HTTP status, JSON body) answering Strava's subscription handshake."""
+        if params.get('hub.mode') != 'subscribe' or 'hub.challenge' not in params:
+            return 400, {"error": "not a subscription handshake"}
+        if not self.verify_token or params.get('hub.verify_token') != self.verify_token:
+            return 403, {"error": "verify token mismatch"}
+        return 200, {"hub.challenge": params['hub.challenge']}
+
+    @staticmethod
+    def validate(event):
+        """Error message for a malformed event, or None."""
+        if not isinstance(event, dict):
+            return "event must be a JSON object"
+        for key in ('object_type', 'object_id', 'aspect_type', 'owner_id'):
+            if key not in event:
+                return f"missing {key}"
+        if event['object_type'] not in OBJECT_TYPES or event['aspect_type'] not in ASPECT_TYPES:
+            return "unknown object_type or aspect_type"
+        return None
+
+    def handle_event(self, event):
+        """Apply one event to the store; returns a short description of what was done."""
+        error = self.validate(event)
+        if error:
+            return f"ignored: {error}"
+        owner_id, object_id = int(event['owner_id']), int(event['object_id'])
+        updates = event.get('updates') or {}
+        instrumentation.count(f"webhook.{event['object_type']}.{event['aspect_type']}")
+
+        if event['object_type'] == 'athlete':
+            if str(updates.get('authorized', '')).lower() == 'false':
+                self.store.delete_athlete(owner_id)
+                return f"athlete {owner_id} deauthorized: cache cleared"
+            return "ignored: athlete update"
+
+        if event['aspect_type'] == 'delete':
+            removed = self.store.delete_activity(owner_id, object_id)
+            return f"activity {object_id} deleted" if removed else f"activity {object_id} not cached"
+
+        cached = self.store.get_activity(owner_id, object_id)
+        if event['aspect_type'] == 'update' and cached is not None and set(updates) <= {'title', 'type', 'private'}:
+            # Title and type changes are fully described by the event
+            if 'title' in updates:
+                cached.name = updates['title']
+            if 'type' in updates:
+                cached.type = updates['type']
+            self.store.upsert_activities(owner_id, [cached])
+            return f"activity {object_id} updated locally"
+
+        try:
+            ride = self.fetch_activity(owner_id, object_id)
+        except Exception as e:
+            print(f"Error fetching activity {object_id}: {e}")
+            ride = None
+        if ride is None:
+            # Cannot see the activity: make recently ending windows sync again instead
+            event_time = int(event.get('event_time') or time.time())
+            self.store.invalidate(owner_id, event_time - SYNC_GRACE_SECONDS)
+            return f"activity {object_id} not fetched: recent windows marked for re-sync"
+        self.store.upsert_activities(owner_id, [ride])
+        return f"activity {object_id} {event['aspect_type']}d"
+
+
+class WebhookServer:
+    """HTTP endpoint for the processor; events are queued and applied by one worker thread."""
+
+    def __init__(self, processor, host="0.0.0.0", port=DEFAULT_PORT, log=print):
+        self.processor = processor
+        self.log = log
+        self.events = queue.Queue()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._worker = threading.Thread(target=self._apply_events, daemon=True)
+        self._stopped = threading.Event()
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                params = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(self.path).query))
+                self._reply(*server.processor.verify(params))
+
+            def do_POST(self):
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                    event = json.loads(self.rfile.read(length) or b"null")
+                except ValueError:
+                    self._reply(400, {"error": "invalid JSON"})
+                    return
+                error = server.processor.validate(event)
+                if error:
+                    self._reply(400, {"error": error})
+                    return
+                # Strava expects a 200 within two seconds, so apply the event afterwards
+                server.events.put(event)
+                self._reply(200, {"status": "queued"})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _apply_events(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                break
+            try:
+                self.log(self.processor.handle_event(event))
+            except Exception as e:
+                print(f"Error applying webhook event {event}: {e}")
+            finally:
+                self.events.task_done()
+
+    def _heartbeat(self):
+        while not self._stopped.wait(HEARTBEAT_SECONDS):
+            try:
+                self.processor.store.webhook_heartbeat()
+            except Exception as e:
+                print(f"Error recording webhook heartbeat: {e}")
+
+    def _go_live(self):
+        self._worker.start()
+        self.processor.store.set_webhook_live()
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+
+    def start(self):
+        """Serve in background threads and mark the store as kept live by webhook events."""
+        self._go_live()
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def serve_forever(self):
+        self._go_live()
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stop serving; the store goes back to polling for changes."""
+        self._stopped.set()
+        self.processor.store.set_webhook_live(False)
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.events.put(None)
+
+
+def send_event(url, aspect_type, object_id, owner_id, object_type='activity', updates=None, event_time=None):
+    """Local stand-in for Strava: POST one event to a receiver. Returns (status, body)."""
+    event = {
+        "object_type": object_type,
+        "object_id": object_id,
+        "aspect_type": aspect_type,
+        "owner_id": owner_id,
+        "updates": updates or {},
+        "event_time": int(event_time or time.time()),
+        "subscription_id": 0,
+    }
+    request = urllib.request.Request(url, data=json.dumps(event).encode(), method="POST",
+                                     headers={"Content-Type": "application/json"})
+    return _open(request)
+
+
+def send_handshake(url, verify_token, challenge="test-challenge"):
+    """Local stand-in for Strava's subscription validation GET. Returns (status, body)."""
+    query = urllib.parse.urlencode({"hub.mode": "subscribe", "hub.verify_token": verify_token, "hub.challenge": challenge})
+    return _open(urllib.request.Request(f"{url}?{query}"))
+
+
+def _open(request):
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read() or b"null")
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"null")